@@ -1,11 +1,94 @@
-from datetime import date, datetime
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, replace
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
 import re
 import base64
-
-from flask import Flask, render_template, jsonify, request
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+from urllib.parse import urlsplit
+
+import click
+from flask import (
+    Flask,
+    g,
+    render_template,
+    jsonify,
+    redirect,
+    request,
+    send_from_directory,
+)
 from openpyxl import load_workbook
 
-from config import EXCEL_FILE
+from config import (
+    API_CACHE_MAX_AGE,
+    CAPTURE_AT,
+    DATE_DETECT_SAMPLE_ROWS,
+    DATE_PARSE_CACHE_SIZE,
+    EVENTS_HOST,
+    EVENTS_KEEPALIVE_SECONDS,
+    EVENTS_PATH,
+    EVENTS_PORT,
+    EXCEL_FILE,
+    HIDDEN_SHEET_NAMES,
+    MAX_BATCH_DATES,
+    METRICS_ENABLED,
+    PARSE_IN_SUBPROCESS,
+    PARSE_SUBPROCESS_MIN_BYTES,
+    PARSE_WORKERS,
+    PROFILE_KEEP_FILES,
+    PROFILE_TOKEN,
+    PROFILES_DIR,
+    RELOAD_INTERVAL_SECONDS,
+    RESPONSE_CACHE_MAX_BYTES,
+    ROW_KEY_COLUMN_NAMES,
+    SCREENSHOT_FORMAT,
+    SCREENSHOT_KEEP_DAYS,
+    SCREENSHOT_KEEP_FILES,
+    SCREENSHOT_MAX_BYTES,
+    SCREENSHOTS_DIR,
+    SERVE_HOST,
+    SERVE_PORT,
+    SERVE_THREADS,
+    SERVE_WORKERS,
+    SERVER_TIMING,
+    SNAPSHOT_FILE,
+    WORKBOOK_HISTORY_SIZE,
+)
+from events import EventServer
+from metrics import (
+    REGISTRY,
+    SIZE_BUCKETS,
+    StageClock,
+    finish_request,
+    mark,
+    record_stage,
+    server_timing,
+    stage,
+    start_request,
+)
+from profiling import (
+    PROFILE_NAME_RE,
+    list_profiles,
+    save_profile,
+    start_profile,
+    stop_profile,
+)
+from response_cache import ENCODINGS, ResponseCache, SingleFlight, encode_body
+from rowtable import RowTable
+from render import render_dashboard_svg
+from screenshots import ScreenshotError, ScreenshotWorker, save_bytes, save_stream
+from snapshot import read_snapshot, write_snapshot
 
 app = Flask(__name__)
 
@@ -13,6 +96,68 @@ app = Flask(__name__)
 # ---------------------- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ----------------------
 
 
+# Все поддерживаемые раскладки даты одним выражением:
+#   ГГГГ-ММ-ДД, ГГГГ/ММ/ДД, ДД.ММ.ГГГГ, ДД.ММ.ГГ, ДД-ММ-ГГГГ, ДД/ММ/ГГ и т.п.
+# Разделитель внутри даты должен быть одним и тем же. re.ASCII: \d – только
+# 0-9, как у strptime (полноширинные и прочие цифры датой не считаем).
+_DATE_RE = re.compile(
+    r"(?P<iy>\d{4})(?P<isep>[-/])(?P<im>\d{1,2})(?P=isep)(?P<id>\d{1,2})"
+    r"|(?P<d>\d{1,2})(?P<sep>[.\-/])(?P<m>\d{1,2})(?P=sep)(?P<y>\d{4}|\d{2})",
+    re.ASCII,
+)
+_DATE_JUNK_RE = re.compile(r"[^0-9.\-/: ]")
+
+
+def _match_date(s: str) -> date | None:
+    m = _DATE_RE.fullmatch(s)
+    if m is None:
+        return None
+
+    if m.group("iy") is not None:
+        year, month, day = m.group("iy", "im", "id")
+    else:
+        day, month, year = m.group("d", "m", "y")
+
+    y = int(year)
+    if len(year) == 2:
+        # Как у strptime("%y"): 00–68 -> 20xx, 69–99 -> 19xx
+        y += 2000 if y < 69 else 1900
+
+    try:
+        return date(y, int(month), int(day))
+    except ValueError:
+        # 31.02.2025 и т.п.
+        return None
+
+
+@lru_cache(maxsize=DATE_PARSE_CACHE_SIZE)
+def _parse_date_string(raw: str) -> date | None:
+    s = raw.strip()
+    if not s:
+        return None
+
+    # Быстрый путь: строка уже в одном из форматов без хвостов
+    d = _match_date(s)
+    if d is not None:
+        return d
+
+    # убираем типичные хвосты
+    s = (
+        s.replace("года", "")
+        .replace("год", "")
+        .replace("г.", " ")
+        .replace("г", " ")
+    )
+
+    # оставляем только цифры, разделители и пробел/двоеточие
+    s = _DATE_JUNK_RE.sub("", s).strip()
+    if not s:
+        return None
+
+    # Если есть время через пробел — дата в части до пробела
+    return _match_date(s.split(" ", 1)[0])
+
+
 def parse_excel_date(cell) -> date | None:
     """
     Универсальный парсер даты из ячейки Excel.
@@ -30,6 +175,9 @@ def parse_excel_date(cell) -> date | None:
 
     Любые хвосты типа 'г.' / 'год' отбрасываются.
     Если распарсить не удалось – возвращаем None.
+
+    Строки разбираются одним заранее скомпилированным выражением,
+    результат кэшируется по исходной строке (значения в колонках повторяются).
     """
     # Уже Python-даты
     if isinstance(cell, datetime):
@@ -39,128 +187,348 @@ def parse_excel_date(cell) -> date | None:
 
     # Строки
     if isinstance(cell, str):
-        s = cell.strip()
-        if not s:
-            return None
+        return _parse_date_string(cell)
+
+    # Остальное (числа, None и т.п.) не трогаем как даты
+    return None
+
+
+def _display_cell(cell):
+    """
+    Ячейка так, как её видит фронт: даты (и строки с датой) – YYYY-MM-DD,
+    остальное как есть. Считается при построении таблицы листа (RowTable).
+    """
+    cell_date = parse_excel_date(cell)
+    if cell_date is not None:
+        return cell_date.strftime("%Y-%m-%d")
+    return cell
+
+
+# ---------------------- КЭШ РАЗОБРАННОЙ КНИГИ ----------------------
 
-        # убираем типичные хвосты
-        s = (
-            s.replace("года", "")
-            .replace("год", "")
-            .replace("г.", " ")
-            .replace("г", " ")
+
+@dataclass(frozen=True)
+class ParsedWorkbook:
+    """
+    Разобранная книга Excel – единая модель дашборда: заголовки и строки всех
+    листов в порядке листов плюс то, что из них выводится.
+
+    stamp   – (mtime_ns, size) файла, по которому проверяем актуальность;
+    version – sha1 содержимого файла (меняется только при реальных правках);
+    headers – имя листа -> строка заголовка (пустой лист -> ());
+    schemas – имя листа -> типы колонок листа (см. SheetSchema);
+    indexes – имя листа -> строки листа, разложенные по датам (см. SheetIndex).
+
+    Считаются один раз при создании (шапка, архив дат и блоки всегда
+    берутся из одной и той же версии книги):
+    dates          – все даты всех листов по убыванию (см. collect_all_dates);
+    header_metrics – курсы для шапки (см. get_header_metrics).
+    """
+
+    stamp: tuple[int, int]
+    version: str
+    headers: dict[str, tuple]
+    schemas: dict[str, "SheetSchema"]
+    indexes: dict[str, "SheetIndex"]
+    dates: list[date] = field(init=False, repr=False, compare=False)
+    header_metrics: dict = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        dates_set: set[date] = set()
+        for index in self.indexes.values():
+            dates_set.update(index.dates)
+
+        object.__setattr__(self, "dates", sorted(dates_set, reverse=True))
+        object.__setattr__(
+            self, "header_metrics", _header_metrics(self.headers, self.indexes)
         )
-        s = s.strip()
 
-        # оставляем только цифры, разделители и пробел/двоеточие
-        s = re.sub(r"[^0-9.\-/: ]", "", s).strip()
-        if not s:
+
+@dataclass(frozen=True)
+class SheetSchema:
+    """
+    Раскладка колонок листа, определяется один раз при разборе книги.
+
+    date_col_index    – дата-колонка (None – лист без дат);
+    numeric_columns   – колонки, где на листе встречаются числа;
+    product_col_index – колонка-ключ строк (ROW_KEY_COLUMN_NAMES в config.py,
+                        по умолчанию первая).
+    """
+
+    date_col_index: int | None
+    numeric_columns: tuple[int, ...]
+    product_col_index: int
+
+
+@dataclass(frozen=True)
+class SheetIndex:
+    """
+    Индекс строк листа по дате, строится один раз при разборе книги.
+
+    dates   – уникальные даты листа по возрастанию;
+    rows    – строки с датой, сгруппированные по дате (внутри даты – в порядке
+              листа), в компактном виде (см. rowtable.py);
+    offsets – границы групп: строки dates[i] = rows[offsets[i]:offsets[i + 1]];
+    changes – изменения к предыдущей дате, changes[i] – для dates[i]
+              (см. _build_day_changes).
+
+    У листа без дата-колонки dates пуст, а rows – все непустые строки как есть.
+    """
+
+    dates: list[date]
+    offsets: list[int]
+    rows: RowTable
+    changes: list[dict] = field(default_factory=list, compare=False)
+
+    def position_for(self, date_filter: date | None) -> int | None:
+        """
+        Позиция даты в self.dates для запроса:
+        точное совпадение или ближайшая предыдущая дата,
+        а если таких нет (или date_filter не задан) – самая последняя.
+        """
+        if not self.dates:
             return None
+        if date_filter is None:
+            return len(self.dates) - 1
 
-        # Если есть время через пробел — берём отдельно весь s и отдельно часть до пробела
-        if " " in s:
-            first_part = s.split(" ")[0].strip()
-        else:
-            first_part = s
-
-        candidates = [s]
-        if first_part != s:
-            candidates.append(first_part)
-
-        # Набор форматов, которые пробуем
-        formats = [
-            "%Y-%m-%d",
-            "%Y/%m/%d",
-            "%d.%m.%Y",
-            "%d.%m.%y",
-            "%d-%m-%Y",
-            "%d-%m-%y",
-            "%d/%m/%Y",
-            "%d/%m/%y",
-        ]
-
-        for cand in candidates:
-            for fmt in formats:
-                try:
-                    dt = datetime.strptime(cand, fmt)
-                    # Поддержка двухзначного года: 25 -> 2025
-                    if dt.year < 100:
-                        dt = dt.replace(year=2000 + dt.year)
-                    return dt.date()
-                except ValueError:
-                    continue
+        pos = bisect_right(self.dates, date_filter) - 1
+        if pos < 0:
+            pos = len(self.dates) - 1
+        return pos
 
-    # Остальное (числа, None и т.п.) не трогаем как даты
+    def span(self, pos: int | None) -> tuple[int, int]:
+        """
+        Границы строк даты dates[pos] в self.rows (None – все строки).
+        """
+        if pos is None:
+            return 0, len(self.rows)
+        return self.offsets[pos], self.offsets[pos + 1]
+
+    def rows_at(self, pos: int) -> list[tuple]:
+        lo, hi = self.span(pos)
+        return self.rows[lo:hi]
+
+
+@dataclass(frozen=True)
+class BlockView:
+    """
+    Какая часть блоков нужна клиенту (параметры /api/blocks).
+
+    sheets  – имена листов (None – все, кроме HIDDEN_SHEET_NAMES);
+    columns – имена колонок в нужном порядке (None – все как в листе);
+    offset  – сколько строк блока пропустить;
+    limit   – сколько строк отдать (None – до конца).
+    """
+
+    sheets: tuple[str, ...] | None = None
+    columns: tuple[str, ...] | None = None
+    offset: int = 0
+    limit: int | None = None
+
+    @property
+    def paged(self) -> bool:
+        return self.offset > 0 or self.limit is not None
+
+    def etag_parts(self) -> tuple[str, ...]:
+        """
+        Части ETag для этого вида (у вида по умолчанию – никаких).
+        """
+        parts: list[str] = []
+        if self.sheets is not None:
+            parts += ["sheets", *self.sheets]
+        if self.columns is not None:
+            parts += ["columns", *self.columns]
+        if self.paged:
+            parts += ["page", str(self.offset), str(self.limit)]
+        return tuple(parts)
+
+
+_DEFAULT_VIEW = BlockView()
+
+
+_workbook_cache: ParsedWorkbook | None = None
+_workbook_lock = threading.Lock()
+_reloader_thread: threading.Thread | None = None
+
+# Последние версии книги (version -> книга) для дельт /api/blocks?since=
+_workbook_history: OrderedDict[str, ParsedWorkbook] = OrderedDict()
+
+# Канал событий об обновлении книги (SSE, см. events.py)
+_events = EventServer(EVENTS_PATH, EVENTS_KEEPALIVE_SECONDS)
+
+# Готовые тела ответов API по ETag (версия книги + запрос)
+_response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES)
+_body_builds = SingleFlight()
+
+# Фоновое пережатие и чистка скриншотов
+_screenshot_worker = ScreenshotWorker(
+    SCREENSHOTS_DIR, SCREENSHOT_FORMAT, SCREENSHOT_KEEP_FILES, SCREENSHOT_KEEP_DAYS
+)
+
+# Снимки, отрисованные на сервере: (версия книги, дата) -> файл
+_captures: OrderedDict[tuple[str, date | None], Path] = OrderedDict()
+_captures_lock = threading.Lock()
+_capture_thread: threading.Thread | None = None
+
+
+# ---------------------------- МЕТРИКИ ----------------------------
+# Отдаются на /metrics (см. metrics.py); время этапов – dashboard_stage_seconds.
+
+_workbook_loads = REGISTRY.counter(
+    "dashboard_workbook_loads_total",
+    "Загрузки книги: snapshot – из снапшота, xlsx – разбор файла, "
+    "touched – файл тронут без изменений",
+    ("source",),
+)
+_workbook_reload_errors = REGISTRY.counter(
+    "dashboard_workbook_reload_errors_total",
+    "Неудачные попытки перечитать книгу",
+)
+_response_cache_requests = REGISTRY.counter(
+    "dashboard_response_cache_requests_total",
+    "Ответы API по кэшу готовых тел: hit, miss, not-modified (304)",
+    ("result",),
+)
+_request_seconds = REGISTRY.histogram(
+    "dashboard_request_seconds",
+    "Время обработки запроса",
+    ("route", "method", "status"),
+)
+_response_bytes = REGISTRY.histogram(
+    "dashboard_response_bytes",
+    "Размер тела ответа",
+    ("route", "encoding"),
+    SIZE_BUCKETS,
+)
+
+
+def _workbook_gauges(read):
+    # Метрики текущей книги; пока книга не загружена – пусто
+    def collect():
+        wb = _workbook_cache
+        return [] if wb is None else read(wb)
+
+    return collect
+
+
+REGISTRY.collected(
+    "dashboard_workbook_info",
+    "Текущая версия книги (хэш содержимого)",
+    _workbook_gauges(lambda wb: [((wb.version,), 1)]),
+    ("version",),
+)
+REGISTRY.collected(
+    "dashboard_workbook_age_seconds",
+    "Сколько секунд назад изменён файл текущей книги",
+    _workbook_gauges(lambda wb: [((), time.time() - wb.stamp[0] / 1e9)]),
+)
+REGISTRY.collected(
+    "dashboard_workbook_rows",
+    "Строк в листах текущей книги",
+    _workbook_gauges(
+        lambda wb: [((name,), len(wb.indexes[name].rows)) for name in wb.headers]
+    ),
+    ("sheet",),
+)
+REGISTRY.collected(
+    "dashboard_workbook_history_size",
+    "Версий книги в памяти (для дельт)",
+    lambda: [((), len(_workbook_history))],
+)
+REGISTRY.collected(
+    "dashboard_response_cache_entries",
+    "Ответов в кэше готовых тел",
+    lambda: [((), len(_response_cache))],
+)
+REGISTRY.collected(
+    "dashboard_response_cache_bytes",
+    "Размер кэша готовых тел, байт",
+    lambda: [((), _response_cache.total_bytes)],
+)
+REGISTRY.collected(
+    "dashboard_date_parse_cache_total",
+    "Обращения к кэшу разбора дат-строк: hit, miss",
+    lambda: [
+        (("hit",), _parse_date_string.cache_info().hits),
+        (("miss",), _parse_date_string.cache_info().misses),
+    ],
+    ("result",),
+    kind="counter",
+)
+
+
+def _read_sheet(ws) -> tuple[tuple, list[tuple]]:
+    """
+    Построчно читаем лист (книга открыта в read_only, строки идут потоком).
+
+    Возвращаем заголовок и непустые строки данных (пустые строки – в
+    read_only их бывает много в хвосте листа – никуда не попадают).
+
+    Размер листа из тега <dimension> не берём: некоторые программы пишут его
+    неверным (например, "A1"), и read_only тогда молча отдаёт одну строку.
+    Без него строки идут своей длины – доводим их до ширины листа (самой
+    длинной строки), как было бы с верным <dimension>.
+    """
+    ws.reset_dimensions()
+    rows_iter = ws.iter_rows(values_only=True)
+    header = next(rows_iter, None)
+    if header is None:
+        return (), []
+
+    width = len(header)
+    data_rows: list[tuple] = []
+    for row in rows_iter:
+        if any(cell is not None for cell in row):
+            data_rows.append(row)
+            width = max(width, len(row))
+
+    pad = (None,) * width
+    header = header + pad[len(header) :]
+    data_rows = [
+        row if len(row) == width else row + pad[len(row) :] for row in data_rows
+    ]
+    return header, data_rows
+
+
+def _find_column(header: tuple, *needles: str) -> int | None:
+    """
+    Первая колонка, в названии которой есть одна из подстрок (без учёта регистра).
+    """
+    for j, name in enumerate(header):
+        if name is None:
+            continue
+        s = str(name).strip().lower()
+        if any(needle in s for needle in needles):
+            return j
     return None
 
 
-def get_header_metrics() -> dict:
+def _header_metrics(headers: dict[str, tuple], indexes: dict[str, SheetIndex]) -> dict:
     """
-    Данные для шапки: курс USD и Brent из листа 'Курсы'.
+    Курс USD и Brent для шапки из листа 'Курсы' (см. ParsedWorkbook).
     """
     usd_rate = None
     brent_price = None
 
     try:
-        if not EXCEL_FILE.exists():
-            return {"usd_rate": None, "brent_price": None}
-
-        wb = load_workbook(EXCEL_FILE, data_only=True)
-        if "Курсы" not in wb.sheetnames:
+        if "Курсы" not in headers:
             return {"usd_rate": None, "brent_price": None}
 
-        ws = wb["Курсы"]
-        rows = list(ws.iter_rows(values_only=True))
-        if len(rows) < 2:
+        header = headers["Курсы"]
+        index = indexes["Курсы"]
+        if not index.rows:
             return {"usd_rate": None, "brent_price": None}
 
-        header = rows[0]
-        data_rows = rows[1:]
-
-        usd_idx = None
-        brent_idx = None
-        date_idx = None
-
-        for j, name in enumerate(header):
-            if name is None:
-                continue
-            s = str(name).strip().lower()
-            if usd_idx is None and ("usd" in s or "доллар" in s):
-                usd_idx = j
-            if brent_idx is None and ("brent" in s or "брент" in s):
-                brent_idx = j
-            if "дата" in s or "date" in s:
-                date_idx = j
-
-        target_row = None
-
-        # Если есть колонка даты — выбираем строку с максимальной датой
-        if date_idx is not None:
-            latest_date = None
-
-            for row in data_rows:
-                if row is None or date_idx >= len(row):
-                    continue
-                cell_date = parse_excel_date(row[date_idx])
-                if cell_date is None:
-                    continue
-
-                if latest_date is None or cell_date > latest_date:
-                    latest_date = cell_date
-                    target_row = row
+        usd_idx = _find_column(header, "usd", "доллар")
+        brent_idx = _find_column(header, "brent", "брент")
 
-            if target_row is None:
-                # fallback: последняя непустая строка
-                for row in reversed(data_rows):
-                    if row and any(c is not None for c in row):
-                        target_row = row
-                        break
+        # Если есть колонка даты — берём строку с максимальной датой,
+        # иначе последнюю непустую строку
+        latest_pos = index.position_for(None)
+        if latest_pos is not None:
+            target_row = index.rows_at(latest_pos)[0]
         else:
-            # Нет колонки даты — берём последнюю непустую строку
-            for row in reversed(data_rows):
-                if row and any(c is not None for c in row):
-                    target_row = row
-                    break
+            target_row = index.rows[-1]
 
         if not target_row:
             return {"usd_rate": None, "brent_price": None}
@@ -187,54 +555,712 @@ def get_header_metrics() -> dict:
     return {"usd_rate": usd_rate, "brent_price": brent_price}
 
 
-def collect_all_dates() -> list[date]:
+def _detect_date_column(header: tuple, data_rows: list[tuple]) -> int | None:
     """
-    Собираем все даты из всех листов, где есть дата-колонка.
-    Возвращаем уникальные даты по убыванию (последние – первые).
+    Ищем дата-колонку за один проход по первым DATE_DETECT_SAMPLE_ROWS строкам.
+
+    Колонка с «дата»/«date» в названии выигрывает, если в выборке в ней есть
+    хоть одна дата. Иначе берём самую левую колонку, где в выборке встретилась
+    дата: в каждой строке проверяем только колонки левее уже найденной.
     """
-    if not EXCEL_FILE.exists():
-        raise FileNotFoundError(
-            f"Excel-файл не найден: {EXCEL_FILE}. "
-            f"Проверь путь в config.py или имя файла."
-        )
+    hint = _find_column(header, "дата", "date")
+    best: int | None = None
+
+    for row in data_rows[:DATE_DETECT_SAMPLE_ROWS]:
+        if (
+            hint is not None
+            and hint < len(row)
+            and parse_excel_date(row[hint]) is not None
+        ):
+            return hint
+
+        limit = len(row) if best is None else min(best, len(row))
+        for col_idx in range(limit):
+            if parse_excel_date(row[col_idx]) is not None:
+                best = col_idx
+                break
+
+    return best
+
 
-    wb = load_workbook(EXCEL_FILE, data_only=True)
-    dates_set: set[date] = set()
+def _build_sheet_schema(header: tuple, data_rows: list[tuple]) -> SheetSchema:
+    numeric_flags = [False] * len(header)
+    for row in data_rows:
+        for idx, cell in enumerate(row):
+            if isinstance(cell, (int, float)):
+                numeric_flags[idx] = True
 
-    for ws in wb.worksheets:
-        rows = list(ws.iter_rows(values_only=True))
-        if len(rows) < 2:
+    product_col_index = _find_column(header, *ROW_KEY_COLUMN_NAMES)
+
+    return SheetSchema(
+        date_col_index=_detect_date_column(header, data_rows),
+        numeric_columns=tuple(
+            idx for idx, is_num in enumerate(numeric_flags) if is_num
+        ),
+        product_col_index=product_col_index if product_col_index is not None else 0,
+    )
+
+
+def _build_sheet_index(
+    data_rows: list[tuple], date_col_index: int | None
+) -> SheetIndex:
+    """
+    Раскладываем строки листа по датам из дата-колонки.
+    """
+    if date_col_index is None:
+        return SheetIndex(
+            dates=[],
+            offsets=[0, len(data_rows)],
+            rows=RowTable(data_rows, _display_cell),
+        )
+
+    date_to_rows: dict[date, list[tuple]] = {}
+    for row in data_rows:
+        if date_col_index >= len(row):
             continue
+        d = parse_excel_date(row[date_col_index])
+        if d is None:
+            continue
+        date_to_rows.setdefault(d, []).append(row)
+
+    dates = sorted(date_to_rows)
+    offsets = [0]
+    rows: list[tuple] = []
+    for d in dates:
+        rows.extend(date_to_rows[d])
+        offsets.append(len(rows))
+
+    return SheetIndex(dates=dates, offsets=offsets, rows=RowTable(rows, _display_cell))
 
-        header = rows[0]
-        data_rows = rows[1:]
 
-        # Ищем колонку с датой
-        date_col_index = None
-        for col_idx in range(len(header)):
-            for row in data_rows:
-                if row is None or col_idx >= len(row):
+def _build_day_changes(
+    header: tuple, schema: SheetSchema, index: SheetIndex
+) -> list[dict]:
+    """
+    Изменения каждой даты листа к предыдущей дате листа:
+        changes[pos] = {ключ строки: {колонка: [было, разница, разница в %]}}.
+
+    Ключ строки – текст колонки schema.product_col_index (как у _row_keys),
+    сравниваются числовые ячейки строк с одинаковым ключом (при повторе
+    ключа за день берётся последняя строка). Процент – None, если было 0.
+    У первой даты изменений нет, у листа без дат список пуст.
+    """
+    if not index.dates:
+        return []
+
+    columns = [str(c) if c is not None else "" for c in header]
+    key_col = schema.product_col_index
+    numeric = [j for j in schema.numeric_columns if j < len(columns) and j != key_col]
+
+    def values_by_key(pos: int) -> dict[str, dict[int, float]]:
+        result: dict[str, dict[int, float]] = {}
+        for row in index.rows_at(pos):
+            key = _key_text(_display_cell(row[key_col]) if key_col < len(row) else None)
+            if not key:
+                continue
+            values = result.setdefault(key, {})
+            for j in numeric:
+                cell = row[j] if j < len(row) else None
+                if isinstance(cell, (int, float)) and not isinstance(cell, bool):
+                    values[j] = cell
+        return result
+
+    changes: list[dict] = [{}]
+    prev = values_by_key(0)
+    for pos in range(1, len(index.dates)):
+        cur = values_by_key(pos)
+        day: dict[str, dict[str, list]] = {}
+
+        for key, values in cur.items():
+            before = prev.get(key)
+            if not before:
+                continue
+            cells = {}
+            for j, value in values.items():
+                if j not in before:
                     continue
-                if parse_excel_date(row[col_idx]) is not None:
-                    date_col_index = col_idx
-                    break
-            if date_col_index is not None:
-                break
+                old = before[j]
+                diff = value - old
+                if isinstance(diff, float):
+                    diff = round(diff, 6)
+                cells[columns[j]] = [
+                    old,
+                    diff,
+                    round((value - old) / abs(old) * 100, 2) if old else None,
+                ]
+            if cells:
+                day[key] = cells
 
-        if date_col_index is None:
-            continue
+        changes.append(day)
+        prev = cur
+
+    return changes
+
+
+def _with_day_changes(
+    header: tuple, schema: SheetSchema, index: SheetIndex
+) -> SheetIndex:
+    return replace(index, changes=_build_day_changes(header, schema, index))
 
-        for row in data_rows:
-            if row is None or date_col_index >= len(row):
+
+def _file_stamp() -> tuple[int, int]:
+    st = EXCEL_FILE.stat()
+    return st.st_mtime_ns, st.st_size
+
+
+def _parse_sheets(
+    content: bytes, part: int = 0, parts: int = 1
+) -> tuple[list[tuple[int, str, tuple, SheetSchema, SheetIndex]], dict[str, float]]:
+    """
+    Разобрать листы книги с номерами part, part + parts, part + 2 * parts, ...
+    (по умолчанию – все). Возвращает список (номер листа, имя, заголовок,
+    схема, индекс) и время по этапам разбора (см. _record_parse_stages).
+
+    Это же и задача пула разбора: каждый процесс открывает книгу сам, в
+    read_only чужие листы при этом не читаются.
+    """
+    sheets = []
+    clock = StageClock()
+    with clock.stage("xlsx_open"):
+        wb = load_workbook(BytesIO(content), read_only=True, data_only=True)
+    try:
+        for pos, ws in enumerate(wb.worksheets):
+            if pos % parts != part:
                 continue
-            cell_date = parse_excel_date(row[date_col_index])
-            if cell_date is not None:
-                dates_set.add(cell_date)
+            with clock.stage("xlsx_read"):
+                header, data_rows = _read_sheet(ws)
+            with clock.stage("date_detect"):
+                schema = _build_sheet_schema(header, data_rows)
+            with clock.stage("row_convert"):
+                index = _build_sheet_index(data_rows, schema.date_col_index)
+            with clock.stage("day_changes"):
+                index = _with_day_changes(header, schema, index)
+            sheets.append((pos, ws.title, header, schema, index))
+    finally:
+        wb.close()
+    return sheets, clock.totals
+
+
+def _record_parse_stages(totals: dict[str, float]) -> None:
+    # Этапы из пула разбора – суммарное время всех процессов, не настенное
+    for name, seconds in totals.items():
+        record_stage(name, seconds)
+
+
+def _workbook_from_sheets(
+    stamp: tuple[int, int],
+    version: str,
+    sheets: list[tuple[int, str, tuple, SheetSchema, SheetIndex]],
+) -> ParsedWorkbook:
+    headers: dict[str, tuple] = {}
+    schemas: dict[str, SheetSchema] = {}
+    indexes: dict[str, SheetIndex] = {}
+
+    # Листы собираем в порядке книги, в каком бы порядке их ни разобрали
+    for _, title, header, schema, index in sorted(sheets, key=lambda s: s[0]):
+        headers[title] = header
+        schemas[title] = schema
+        indexes[title] = index
+
+    return ParsedWorkbook(
+        stamp=stamp,
+        version=version,
+        headers=headers,
+        schemas=schemas,
+        indexes=indexes,
+    )
+
+
+def _parse_workbook(
+    content: bytes, stamp: tuple[int, int], version: str
+) -> ParsedWorkbook:
+    sheets, totals = _parse_sheets(content)
+    _record_parse_stages(totals)
+    return _workbook_from_sheets(stamp, version, sheets)
+
+
+# Снапшот хранит и то, что вычислено при разборе (схемы листов: дата-колонка,
+# колонка-ключ), поэтому годен, только если разбирали тем же кодом и с теми же
+# настройками. _PARSE_FORMAT увеличивать при изменении разбора листов или
+# состава снапшота.
+_PARSE_FORMAT = 3
+
+
+def _parse_fingerprint() -> dict:
+    return {
+        "parse_format": _PARSE_FORMAT,
+        "date_detect_sample_rows": DATE_DETECT_SAMPLE_ROWS,
+        "row_key_column_names": list(ROW_KEY_COLUMN_NAMES),
+    }
+
+
+def _write_snapshot(wb: ParsedWorkbook) -> None:
+    """
+    Снапшот: строки листов по колонкам + схема, индекс дат и изменения по
+    датам каждого листа (и отпечаток разбора, см. _parse_fingerprint).
+    """
+    sheets_meta = {
+        name: {
+            "date_col_index": wb.schemas[name].date_col_index,
+            "numeric_columns": list(wb.schemas[name].numeric_columns),
+            "product_col_index": wb.schemas[name].product_col_index,
+            "dates": [d.toordinal() for d in wb.indexes[name].dates],
+            "offsets": wb.indexes[name].offsets,
+            "changes": wb.indexes[name].changes,
+        }
+        for name in wb.headers
+    }
+    tables = {name: (wb.headers[name], wb.indexes[name].rows) for name in wb.headers}
+
+    write_snapshot(
+        SNAPSHOT_FILE,
+        wb.stamp,
+        {
+            "version": wb.version,
+            "fingerprint": _parse_fingerprint(),
+            "sheets": sheets_meta,
+        },
+        tables,
+    )
+
+
+def _save_snapshot(wb: ParsedWorkbook) -> None:
+    try:
+        with stage("snapshot_write"):
+            _write_snapshot(wb)
+    except (OSError, ValueError, OverflowError):
+        # Снапшот – только ускорение: не записался – в следующий раз прочитаем xlsx
+        pass
+
+
+def _count_sheets(content: bytes) -> int:
+    # Число листов по оглавлению zip, без разбора книги; 0 – не xlsx
+    # (ошибку тогда покажет обычный разбор)
+    try:
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            names = archive.namelist()
+    except zipfile.BadZipFile:
+        return 0
+    return sum(
+        1
+        for name in names
+        if name.startswith("xl/worksheets/")
+        and name.endswith(".xml")
+        and name.count("/") == 2
+    )
+
+
+def _parse_workbook_offloaded(
+    content: bytes, stamp: tuple[int, int], version: str
+) -> ParsedWorkbook:
+    """
+    Разбор книги в пуле процессов (PARSE_IN_SUBPROCESS): openpyxl держит GIL,
+    и в нашем процессе на время разбора встали бы все остальные запросы.
+    Листы независимы, поэтому делим их между PARSE_WORKERS процессами
+    (см. _parse_sheets) и собираем книгу здесь в исходном порядке листов.
+
+    Пул живёт только на время разбора (разборы редки): под serve мастер
+    форкает воркеры gunicorn, и дочерние процессы пула не должны доставаться
+    им по наследству – на выходе каждого воркера multiprocessing пытался бы
+    их дождаться ("can only join a child process").
+
+    Маленькую книгу (меньше PARSE_SUBPROCESS_MIN_BYTES) разбираем здесь же:
+    запуск процессов обошёлся бы дороже самого разбора. Процессов не больше,
+    чем листов.
+
+    Ошибки разбора (недописанный файл) приходят сюда как есть. Если пул
+    умер или не создался (нет /dev/shm, семафоров и т.п.) – разбираем здесь же.
+    """
+    wb = None
+    workers = min(PARSE_WORKERS, _count_sheets(content))
+    if (
+        PARSE_IN_SUBPROCESS
+        and workers > 0
+        and len(content) >= PARSE_SUBPROCESS_MIN_BYTES
+    ):
+        try:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as pool:
+                futures = [
+                    pool.submit(_parse_sheets, content, part, workers)
+                    for part in range(workers)
+                ]
+                sheets = []
+                for future in futures:
+                    part_sheets, totals = future.result()
+                    sheets += part_sheets
+                    _record_parse_stages(totals)
+            wb = _workbook_from_sheets(stamp, version, sheets)
+        except (BrokenProcessPool, OSError):
+            pass
+
+    if wb is None:
+        wb = _parse_workbook(content, stamp, version)
+    _save_snapshot(wb)
+    return wb
+
+
+def _load_snapshot(stamp: tuple[int, int]) -> ParsedWorkbook | None:
+    with stage("snapshot_read"):
+        return _read_workbook_snapshot(stamp)
+
+
+def _read_workbook_snapshot(stamp: tuple[int, int]) -> ParsedWorkbook | None:
+    loaded = read_snapshot(SNAPSHOT_FILE, stamp)
+    if loaded is None:
+        return None
+
+    meta, tables = loaded
+    if meta.get("fingerprint") != _parse_fingerprint():
+        # Снят другим кодом разбора или с другими настройками – разбираем заново
+        return None
+
+    headers: dict[str, tuple] = {}
+    schemas: dict[str, SheetSchema] = {}
+    indexes: dict[str, SheetIndex] = {}
+
+    for name, (header, columns, lengths) in tables.items():
+        sheet_meta = meta["sheets"][name]
+        headers[name] = header
+        schemas[name] = SheetSchema(
+            date_col_index=sheet_meta["date_col_index"],
+            numeric_columns=tuple(sheet_meta["numeric_columns"]),
+            product_col_index=sheet_meta["product_col_index"],
+        )
+        indexes[name] = SheetIndex(
+            dates=[date.fromordinal(d) for d in sheet_meta["dates"]],
+            offsets=sheet_meta["offsets"],
+            rows=RowTable.from_columns(
+                sheet_meta["offsets"][-1],
+                columns,
+                lengths,
+                _display_cell,
+            ),
+            changes=sheet_meta["changes"],
+        )
+
+    return ParsedWorkbook(
+        stamp=stamp,
+        version=meta["version"],
+        headers=headers,
+        schemas=schemas,
+        indexes=indexes,
+    )
+
+
+def _set_workbook(wb: ParsedWorkbook) -> None:
+    """
+    Подменить текущую книгу и запомнить её в истории версий
+    (по ней /api/blocks?since= считает дельту для клиента).
+    Если версия сменилась – шлём событие в /api/events.
+    """
+    global _workbook_cache
+
+    old = _workbook_cache
+    _workbook_cache = wb
+    _workbook_history[wb.version] = wb
+    _workbook_history.move_to_end(wb.version)
+    while len(_workbook_history) > WORKBOOK_HISTORY_SIZE:
+        _workbook_history.popitem(last=False)
+
+    if old is None or old.version != wb.version:
+        _events.publish(
+            "version",
+            {"version": wb.version, "changedSheets": _changed_sheets(old, wb)},
+        )
+
+
+def _changed_sheets(old: ParsedWorkbook | None, new: ParsedWorkbook) -> list[str]:
+    """
+    Листы, которые отличаются между версиями книги (включая удалённые).
+    """
+    if old is None:
+        return list(new.headers)
+
+    changed = [
+        name
+        for name in new.headers
+        if name not in old.headers
+        or old.headers[name] != new.headers[name]
+        or old.indexes[name] != new.indexes[name]
+    ]
+    changed.extend(name for name in old.headers if name not in new.headers)
+    return changed
+
+
+def _reload_workbook() -> ParsedWorkbook:
+    """
+    Привести кэш в соответствие с файлом (под блокировкой).
 
-    return sorted(dates_set, reverse=True)
+    Если mtime и размер не изменились – ничего не делаем. Иначе сначала
+    пробуем снапшот (SNAPSHOT_FILE), снятый с этой же версии файла. Если его
+    нет – читаем файл: если хэш содержимого тот же (файл просто «тронули»),
+    оставляем старые данные, иначе разбираем книгу заново и подменяем кэш
+    целиком. После чтения xlsx снапшот перезаписывается, чтобы следующий
+    старт обошёлся без openpyxl.
 
+    Недописанный файл (Excel ещё сохраняет) падает на разборе – кэш при этом
+    не трогаем.
+    """
+    with _workbook_lock:
+        if not EXCEL_FILE.exists():
+            raise FileNotFoundError(
+                f"Excel-файл не найден: {EXCEL_FILE}. "
+                f"Проверь путь в config.py или имя файла."
+            )
+
+        # Пока ждали блокировку, кэш мог обновить другой поток
+        stamp = _file_stamp()
+        cached = _workbook_cache
+        if cached is not None and cached.stamp == stamp:
+            return cached
+
+        # Снапшот, снятый с этой же версии файла, читается без openpyxl
+        snapshot = _load_snapshot(stamp)
+        if snapshot is not None:
+            _workbook_loads.inc(source="snapshot")
+            _set_workbook(snapshot)
+            return snapshot
+
+        # Читаем байты один раз: и хэш, и разбор идут по одному содержимому
+        content = EXCEL_FILE.read_bytes()
+        version = hashlib.sha1(content).hexdigest()
+
+        if cached is not None and cached.version == version:
+            _workbook_loads.inc(source="touched")
+            cached = replace(cached, stamp=stamp)
+            _save_snapshot(cached)
+        else:
+            _workbook_loads.inc(source="xlsx")
+            with stage("xlsx_parse"):
+                cached = _parse_workbook_offloaded(content, stamp, version)
+
+        _set_workbook(cached)
+        return cached
+
+
+def get_parsed_workbook() -> ParsedWorkbook:
+    """
+    Общий на процесс кэш разобранной книги.
+
+    Если запущен фоновый перечитыватель (start_workbook_reloader), просто
+    отдаём текущие данные – файл отслеживает он. Иначе сверяем mtime и размер
+    файла и при изменении перечитываем книгу прямо в запросе.
+
+    Если перечитать не вышло (файл недописан или на миг пропал при сохранении),
+    а старые данные есть – отдаём старые.
+    """
+    cached = _workbook_cache
+    if cached is not None and _reloader_thread is not None:
+        return cached
+
+    try:
+        if cached is not None and cached.stamp == _file_stamp():
+            return cached
+        return _reload_workbook()
+    except Exception:
+        _workbook_reload_errors.inc()
+        if cached is None:
+            raise
+        return cached
+
+
+def _reloader_loop(interval: float, on_change) -> None:
+    while True:
+        time.sleep(interval)
+        before = _workbook_cache
+        try:
+            wb = _reload_workbook()
+        except Exception:
+            # Файл недописан или пропал – старые данные остаются,
+            # пробуем ещё раз на следующем круге
+            continue
+
+        if on_change is not None and (before is None or before.version != wb.version):
+            on_change(wb)
+
+
+def start_workbook_reloader(
+    interval: float = RELOAD_INTERVAL_SECONDS, on_change=None
+) -> None:
+    """
+    Запустить фоновый поток, который раз в interval секунд проверяет файл
+    и перечитывает книгу, чтобы запросы не ждали разбора.
+    Первая загрузка делается сразу, до старта потока.
 
-def load_blocks_from_excel(date_filter: date | None = None) -> list[dict]:
+    on_change(wb) – вызывается из потока после подмены книги на новую версию.
+    """
+    global _reloader_thread
+
+    if _reloader_thread is not None:
+        return
+
+    try:
+        _reload_workbook()
+    except Exception:
+        pass
+
+    thread = threading.Thread(
+        target=_reloader_loop,
+        args=(interval, on_change),
+        name="workbook-reloader",
+        daemon=True,
+    )
+    thread.start()
+    _reloader_thread = thread
+
+
+def start_event_server(host: str = SERVE_HOST) -> None:
+    """
+    Поднять канал событий /api/events на EVENTS_PORT. Адрес – EVENTS_HOST,
+    а если он не задан – host, адрес HTTP-сервера: /api/events отправляет
+    браузер на тот же хост, и снаружи канал должен быть виден так же, как сайт.
+    События рождаются при перечитывании книги, поэтому заодно запускаем
+    фоновый перечитыватель.
+
+    EVENTS_PORT = None – канал выключен. Если порт занят, сайт всё равно
+    поднимается: канал остаётся выключенным, /api/events отвечает 503, и
+    дашборды сами опрашивают /api/blocks?since=.
+    """
+    start_workbook_reloader()
+    if EVENTS_PORT is None:
+        return
+    try:
+        _events.start(EVENTS_HOST or host, EVENTS_PORT)
+    except OSError as e:
+        app.logger.warning(
+            "Канал событий на порту %s не поднялся (%s), дашборды будут "
+            "опрашивать сервер",
+            EVENTS_PORT,
+            e,
+        )
+
+
+def _reset_after_fork() -> None:
+    # Форк мог случиться, пока блокировку держал поток мастера (перечитыватель),
+    # в дочернем процессе этого потока нет – начинаем с новой блокировки.
+    # То же с блокировкой снимков (её держит поток расписания снимков).
+    global _workbook_lock, _captures_lock
+    _workbook_lock = threading.Lock()
+    _captures_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def capture_dashboard(target_date: date | None = None) -> Path:
+    """
+    Отрисовать дашборд за дату (None – последние данные) на сервере, без
+    браузера (см. render.py), и сохранить SVG в папку скриншотов под тем же
+    именем, что и у кнопки «Скрин».
+
+    Для одной версии книги и даты рисуем один раз: повторный вызов отдаёт
+    уже сохранённый файл, пока его не удалила чистка.
+    """
+    wb = get_parsed_workbook()
+    key = (wb.version, target_date)
+
+    with _captures_lock:
+        path = _captures.get(key)
+        if path is not None and path.exists():
+            return path
+
+        blocks = load_blocks_from_excel(date_filter=target_date, wb=wb)
+        shown_date = target_date or (wb.dates[0] if wb.dates else None)
+        svg = render_dashboard_svg(
+            "Trastboard",
+            shown_date.strftime("%d.%m.%Y") if shown_date else "",
+            wb.header_metrics,
+            [(b, wb.schemas[b["sheetName"]].date_col_index) for b in blocks],
+        )
+
+        path = save_bytes(svg, SCREENSHOTS_DIR, ".svg")
+        _screenshot_worker.submit(path)
+
+        _captures[key] = path
+        while len(_captures) > WORKBOOK_HISTORY_SIZE:
+            _captures.popitem(last=False)
+        return path
+
+
+def _seconds_until_next_capture(now: datetime) -> float:
+    candidates = []
+    for at in CAPTURE_AT:
+        hour, minute = (int(x) for x in at.split(":"))
+        run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if run <= now:
+            run += timedelta(days=1)
+        candidates.append(run)
+    return (min(candidates) - now).total_seconds()
+
+
+def _capture_loop() -> None:
+    while True:
+        time.sleep(_seconds_until_next_capture(datetime.now()))
+        try:
+            capture_dashboard()
+        except Exception:
+            # Не получилось (нет файла и т.п.) – попробуем в следующий раз
+            pass
+
+
+def start_capture_scheduler() -> None:
+    """
+    Запустить фоновый поток, который в CAPTURE_AT каждый день сохраняет
+    снимок дашборда (capture_dashboard). Без CAPTURE_AT ничего не делает.
+    """
+    global _capture_thread
+
+    if _capture_thread is not None or not CAPTURE_AT:
+        return
+
+    thread = threading.Thread(target=_capture_loop, name="capture", daemon=True)
+    thread.start()
+    _capture_thread = thread
+
+
+def get_header_metrics() -> dict:
+    """
+    Данные для шапки: курс USD и Brent из листа 'Курсы'
+    (считаются один раз при разборе книги, см. ParsedWorkbook.header_metrics).
+    """
+    try:
+        if not EXCEL_FILE.exists():
+            return {"usd_rate": None, "brent_price": None}
+        return dict(get_parsed_workbook().header_metrics)
+    except Exception:
+        return {"usd_rate": None, "brent_price": None}
+
+
+def collect_all_dates(wb: ParsedWorkbook | None = None) -> list[date]:
+    """
+    Все даты из всех листов, где есть дата-колонка: уникальные, по убыванию
+    (последние – первые). Список общий для всех запросов, менять его нельзя.
+    wb – уже полученная книга (по умолчанию берём текущую из кэша).
+    """
+    if wb is None:
+        wb = get_parsed_workbook()
+    return wb.dates
+
+
+def _view_sheets(wb: ParsedWorkbook, view: BlockView) -> list[str]:
+    """
+    Листы книги для вида view в порядке книги.
+    """
+    if view.sheets is None:
+        return [name for name in wb.headers if name not in HIDDEN_SHEET_NAMES]
+    wanted = set(view.sheets)
+    return [name for name in wb.headers if name in wanted]
+
+
+def load_blocks_from_excel(
+    date_filter: date | None = None,
+    wb: ParsedWorkbook | None = None,
+    view: BlockView = _DEFAULT_VIEW,
+) -> list[dict]:
     """
     Читает Excel и формирует список блоков (лист = блок).
 
@@ -244,169 +1270,600 @@ def load_blocks_from_excel(date_filter: date | None = None) -> list[dict]:
       - для листов с датой берём только строки с этой датой (если она есть),
         иначе — ближайшую предыдущую дату на этом листе.
     Для листов без даты – берём все непустые строки.
+
+    wb   – уже полученная книга (по умолчанию берём текущую из кэша);
+    view – какие листы, колонки и строки нужны (см. BlockView).
     """
-    if not EXCEL_FILE.exists():
-        raise FileNotFoundError(
-            f"Excel-файл не найден: {EXCEL_FILE}. "
-            f"Проверь путь в config.py или имя файла."
+    if wb is None:
+        wb = get_parsed_workbook()
+
+    return [
+        _build_block(
+            wb, sheet_name, wb.indexes[sheet_name].position_for(date_filter), view
         )
+        for sheet_name in _view_sheets(wb, view)
+    ]
+
 
-    wb = load_workbook(EXCEL_FILE, data_only=True)
-    blocks: list[dict] = []
-
-    for ws in wb.worksheets:
-        sheet_name = ws.title
-
-        all_rows = list(ws.iter_rows(values_only=True))
-        if not all_rows:
-            blocks.append(
-                {
-                    "id": sheet_name,
-                    "title": sheet_name,
-                    "sheetName": sheet_name,
-                    "columns": [],
-                    "rows": [],
-                    "numericColumns": [],
+def load_blocks_for_dates(
+    dates: list[date], wb: ParsedWorkbook | None = None
+) -> dict[date, list[dict]]:
+    """
+    Блоки сразу за несколько дат: дата -> список блоков, как у
+    load_blocks_from_excel(date_filter=дата).
+
+    Идём по листам один раз: если несколько дат на листе сводятся к одной и
+    той же дате индекса (выходные -> пятница), блок собирается один раз.
+    """
+    if wb is None:
+        wb = get_parsed_workbook()
+
+    result: dict[date, list[dict]] = {d: [] for d in dates}
+
+    for sheet_name in _view_sheets(wb, _DEFAULT_VIEW):
+        index = wb.indexes[sheet_name]
+        built: dict[int | None, dict] = {}
+
+        for d in dates:
+            pos = index.position_for(d)
+            if pos not in built:
+                built[pos] = _build_block(wb, sheet_name, pos)
+            result[d].append(built[pos])
+
+    return result
+
+
+def _build_block(
+    wb: ParsedWorkbook,
+    sheet_name: str,
+    target_pos: int | None,
+    view: BlockView = _DEFAULT_VIEW,
+) -> dict:
+    """
+    Блок одного листа за дату индекса target_pos
+    (None – лист без даты, берём все непустые строки).
+
+    view.columns оставляет только названные колонки (в их порядке), а
+    view.offset/limit – страницу строк; тогда в блоке есть ещё totalRows
+    (сколько всего строк за дату) и offset.
+    """
+    header = wb.headers[sheet_name]
+    if not header:
+        return {
+            "id": sheet_name,
+            "title": sheet_name,
+            "sheetName": sheet_name,
+            "columns": [],
+            "rows": [],
+            "numericColumns": [],
+        }
+
+    columns = [str(c) if c is not None else "" for c in header]
+
+    # Проекция: номера нужных колонок листа (None – все по порядку)
+    picked: list[int] | None = None
+    if view.columns is not None:
+        position = {name: j for j, name in reversed(list(enumerate(columns)))}
+        picked = [position[name] for name in view.columns if name in position]
+
+    # ---------- Строки за нужную дату (по готовому индексу) ----------
+    index = wb.indexes[sheet_name]
+    lo, hi = index.span(target_pos)
+    total_rows = hi - lo
+    page_lo = min(lo + view.offset, hi)
+    page_hi = hi if view.limit is None else min(page_lo + view.limit, hi)
+
+    # ---------- Изменения к предыдущей дате (готовы в индексе) ----------
+    prev_date: date | None = None
+    changes: dict[str, dict[str, list]] = {}
+    key_col: int | None = wb.schemas[sheet_name].product_col_index
+
+    if target_pos is not None and target_pos > 0:
+        prev_date = index.dates[target_pos - 1]
+        changes = index.changes[target_pos]
+
+    # ---------- Строки для фронта (даты уже отформатированы в таблице) ----------
+    # numericColumns – по всем строкам даты, чтобы не менялись от страницы к странице
+    if picked is None:
+        rows = index.rows.display_rows(page_lo, page_hi, len(columns))
+        numeric_indices = index.rows.numeric_columns(lo, hi, len(columns))
+    else:
+        rows = index.rows.project_rows(page_lo, page_hi, picked)
+        numeric_indices = index.rows.numeric_columns(lo, hi, len(columns), picked)
+        if changes:
+            kept = {columns[j] for j in picked}
+            changes = {
+                key: {name: c for name, c in cells.items() if name in kept}
+                for key, cells in changes.items()
+            }
+        key_col = picked.index(key_col) if key_col in picked else None
+        columns = [columns[j] for j in picked]
+
+    block: dict = {
+        "id": sheet_name,
+        "title": sheet_name,
+        "sheetName": sheet_name,
+        "columns": columns,
+        "rows": rows,
+        "numericColumns": numeric_indices,
+    }
+
+    if view.paged:
+        block["totalRows"] = total_rows
+        block["offset"] = page_lo - lo
+
+    # Листам с датой – предыдущая дата и изменения к ней (для подсказок у цен):
+    # changes – {ключ строки: {колонка: [было, разница, %]}}, ключ – текст
+    # колонки keyColumn
+    if index.dates:
+        block["prevDate"] = prev_date.isoformat() if prev_date else None
+        block["keyColumn"] = key_col
+        block["changes"] = changes
+
+    # "Конкурентам" по-прежнему отправляем и вчерашние значения отдельно
+    if sheet_name == "Конкуренты":
+        block["prevDate"] = prev_date.isoformat() if prev_date else None
+        block["prevValues"] = {
+            key: {name: c[0] for name, c in cells.items()}
+            for key, cells in changes.items()
+        }
+
+    return block
+
+
+def _key_text(cell) -> str:
+    """
+    Текст ключевой ячейки так, как его получит фронт из JSON
+    (String(x) в JS): 98000.0 -> "98000", True -> "true".
+    """
+    if cell is None:
+        return ""
+    if isinstance(cell, str):
+        return cell.strip()
+    if isinstance(cell, bool):
+        return "true" if cell else "false"
+    if isinstance(cell, float) and cell.is_integer():
+        return str(int(cell))
+    return str(cell)
+
+
+def _row_keys(rows: list[list], key_col: int) -> list[list]:
+    """
+    Ключи строк блока: [текст ключевой колонки, номер повтора].
+    Номер повтора различает строки с одинаковым значением.
+    Фронт считает те же ключи по своим строкам (rowKeysFor в main.js).
+    """
+    seen: dict[str, int] = {}
+    keys: list[list] = []
+    for row in rows:
+        value = _key_text(row[key_col] if key_col < len(row) else None)
+        n = seen.get(value, 0)
+        seen[value] = n + 1
+        keys.append([value, n])
+    return keys
+
+
+def diff_blocks(
+    old_blocks: list[dict], new_blocks: list[dict], wb: ParsedWorkbook
+) -> dict:
+    """
+    Дельта между двумя списками блоков (старый – то, что уже есть у клиента).
+
+    sheets  – имена листов нового списка по порядку (чего нет – удалено);
+    changes – только изменившиеся листы:
+      {"sheetName", "block"} – лист новый или сменились колонки, шлём целиком;
+      {"sheetName", "keyColumn", "keys", "upserts", "deletes", "fields",
+       "fieldPatches"} – правка строк:
+        keyColumn    – колонка, по которой строятся ключи строк,
+        keys         – ключи всех строк в новом порядке,
+        upserts      – [ключ, строка] для новых и изменённых строк,
+        deletes      – ключи удалённых строк,
+        fields       – изменившиеся поля блока кроме rows и словарей,
+        fieldPatches – изменившиеся поля-словари (changes, prevValues – по
+                       ключу строки) правкой: {поле: {"upserts": {ключ:
+                       значение}, "deletes": [ключ, ...]}}, чтобы правка одной
+                       ячейки не тянула за собой изменения всего листа.
+    Ключ строки – значение колонки «Продукт» листа (см. SheetSchema).
+    """
+    old_by_name = {b["sheetName"]: b for b in old_blocks}
+    changes: list[dict] = []
+
+    for block in new_blocks:
+        name = block["sheetName"]
+        old = old_by_name.get(name)
+        if old == block:
+            continue
+
+        if old is None or old["columns"] != block["columns"]:
+            changes.append({"sheetName": name, "block": block})
+            continue
+
+        key_col = wb.schemas[name].product_col_index
+        old_keys = _row_keys(old["rows"], key_col)
+        new_keys = _row_keys(block["rows"], key_col)
+
+        old_rows = {tuple(k): row for k, row in zip(old_keys, old["rows"])}
+        new_key_set = {tuple(k) for k in new_keys}
+
+        fields: dict = {}
+        patches: dict[str, dict] = {}
+        for key, value in block.items():
+            old_value = old.get(key)
+            if key == "rows" or old_value == value:
+                continue
+            if isinstance(value, dict) and isinstance(old_value, dict):
+                patches[key] = {
+                    "upserts": {
+                        k: v for k, v in value.items() if old_value.get(k) != v
+                    },
+                    "deletes": [k for k in old_value if k not in value],
                 }
-            )
+            else:
+                fields[key] = value
+
+        changes.append(
+            {
+                "sheetName": name,
+                "keyColumn": key_col,
+                "keys": new_keys,
+                "upserts": [
+                    [k, row]
+                    for k, row in zip(new_keys, block["rows"])
+                    if old_rows.get(tuple(k)) != row
+                ],
+                "deletes": [k for k in old_keys if tuple(k) not in new_key_set],
+                "fields": fields,
+                "fieldPatches": patches,
+            }
+        )
+
+    return {"sheets": [b["sheetName"] for b in new_blocks], "changes": changes}
+
+
+# ------------------------ ВРЕМЕННЫЕ РЯДЫ ------------------------
+
+# Начало периода для прореживания ряда (/api/series?step=)
+_SERIES_STEPS = {
+    "day": lambda d: d,
+    "week": lambda d: d - timedelta(days=d.weekday()),
+    "month": lambda d: d.replace(day=1),
+}
+
+# Как сводить значения периода в одно (/api/series?agg=)
+_SERIES_AGGS = {
+    "last": lambda values: values[-1],
+    "avg": lambda values: round(sum(values) / len(values), 6),
+    "min": min,
+    "max": max,
+}
+
+
+def load_series(
+    wb: ParsedWorkbook,
+    sheet_name: str,
+    key: str,
+    column: int,
+    start: date | None = None,
+    end: date | None = None,
+    step: str = "day",
+    agg: str = "last",
+) -> list[list]:
+    """
+    Ряд [[YYYY-MM-DD, значение], ...] по возрастанию дат для строки листа
+    с ключом key (текст колонки-ключа, как в _row_keys) и колонки column.
+
+    Берётся прямо из колонок таблицы листа: строки с ключом ищутся по
+    словарю значений колонки-ключа, числа – из числовой колонки, дата
+    строки – по границам групп индекса. Если за дату строк с ключом
+    несколько, берётся последняя.
+
+    step (day/week/month) прореживает ряд: значения периода сводятся agg
+    (last/avg/min/max), точка ставится на последнюю дату периода с данными.
+    """
+    index = wb.indexes[sheet_name]
+    key_col = wb.schemas[sheet_name].product_col_index
+
+    rows = index.rows.find_rows(key_col, lambda cell: _key_text(cell) == key)
+    by_pos: dict[int, float] = {}
+    for i, value in zip(rows, index.rows.numbers(column, rows)):
+        if value is not None:
+            by_pos[bisect_right(index.offsets, i) - 1] = value
+
+    bucket_of = _SERIES_STEPS[step]
+    reduce = _SERIES_AGGS[agg]
+    buckets: dict[date, tuple[date, list]] = {}
+
+    for pos in sorted(by_pos):
+        d = index.dates[pos]
+        if (start is not None and d < start) or (end is not None and d > end):
             continue
+        bucket = bucket_of(d)
+        last_date, values = buckets.get(bucket, (d, []))
+        values.append(by_pos[pos])
+        buckets[bucket] = (d, values)
 
-        header = all_rows[0]
-        columns = [str(c) if c is not None else "" for c in header]
-        data_rows_raw = all_rows[1:]
+    return [
+        [last_date.isoformat(), reduce(values)]
+        for last_date, values in buckets.values()
+    ]
 
-        # ---------- Ищем дату-колонку ----------
-        date_col_index = None
-        date_to_rows: dict[date, list[tuple]] = {}
 
-        for col_idx in range(len(columns)):
-            for row in data_rows_raw:
-                if row is None or col_idx >= len(row):
-                    continue
-                if parse_excel_date(row[col_idx]) is not None:
-                    date_col_index = col_idx
-                    break
-            if date_col_index is not None:
-                break
+# ------------------------ HTTP-КЭШИРОВАНИЕ API ------------------------
 
-        target_date: date | None = None
-        filtered_rows_raw = data_rows_raw
 
-        if date_col_index is not None:
-            # Собираем строки по датам
-            for row in data_rows_raw:
-                if row is None or date_col_index >= len(row):
-                    continue
-                d = parse_excel_date(row[date_col_index])
-                if d is None:
-                    continue
-                date_to_rows.setdefault(d, []).append(row)
-
-            if date_to_rows:
-                if date_filter is not None:
-                    if date_filter in date_to_rows:
-                        target_date = date_filter
-                    else:
-                        # Берём ближайшую дату <= date_filter, либо последнюю вообще
-                        earlier = [d for d in date_to_rows.keys() if d <= date_filter]
-                        if earlier:
-                            target_date = max(earlier)
-                        else:
-                            target_date = max(date_to_rows.keys())
-                else:
-                    target_date = max(date_to_rows.keys())
-
-                filtered_rows_raw = date_to_rows.get(target_date, [])
-
-        # ---------- Предыдущий день для листа "Конкуренты" ----------
-        prev_date: date | None = None
-        prev_values: dict[str, dict[str, float]] | None = None
+# Версия формы ответов API: входит в ETag, чтобы после выкладки с другими
+# полями браузеры не получили 304 на закэшированный ответ старой формы.
+# Увеличивать при любом изменении полей или структуры ответов API.
+_API_FORMAT = 1
 
-        if (
-            sheet_name == "Конкуренты"
-            and date_col_index is not None
-            and date_to_rows
-            and target_date is not None
-        ):
-            earlier_dates = [d for d in date_to_rows.keys() if d < target_date]
-            if earlier_dates:
-                prev_date = max(earlier_dates)
-                prev_rows_raw = date_to_rows.get(prev_date, [])
-
-                # Определяем колонку "Продукт"
-                product_col_index = 0
-                for idx, col_name in enumerate(columns):
-                    s = str(col_name or "").strip().lower()
-                    if "продукт" in s or "номенклат" in s:
-                        product_col_index = idx
-                        break
-
-                prev_values = {}
-
-                for row in prev_rows_raw:
-                    if row is None or product_col_index >= len(row):
-                        continue
-                    product_cell = row[product_col_index]
-                    if product_cell is None:
-                        continue
-                    product_key = str(product_cell).strip()
-                    if not product_key:
-                        continue
-
-                    row_map = prev_values.setdefault(product_key, {})
-
-                    for j, col_name in enumerate(columns):
-                        if j >= len(row):
-                            continue
-                        val = row[j]
-                        if isinstance(val, (int, float)):
-                            row_map[str(col_name) if col_name is not None else ""] = val
-
-        # ---------- Преобразование строк для фронта ----------
-        rows: list[list] = []
-        numeric_flags = [False] * len(columns)
-
-        for row_raw in filtered_rows_raw:
-            if row_raw is None:
-                continue
 
-            raw_list = list(row_raw[: len(columns)])
-            if all(cell is None for cell in raw_list):
-                continue
+def _api_etag(wb: ParsedWorkbook, *parts: str) -> str:
+    """
+    Сильный ETag ответа: версия формы ответов, версия книги + то, от чего
+    ещё зависит ответ.
+    """
+    key = "|".join((str(_API_FORMAT), wb.version, *parts))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
 
-            display_row: list = []
 
-            for idx, cell in enumerate(raw_list):
-                if isinstance(cell, (int, float)):
-                    numeric_flags[idx] = True
+def _last_modified(wb: ParsedWorkbook) -> datetime:
+    return datetime.fromtimestamp(wb.stamp[0] // 1_000_000_000, tz=timezone.utc)
 
-                cell_date_val = parse_excel_date(cell)
-                if cell_date_val is not None:
-                    display_row.append(cell_date_val.strftime("%Y-%m-%d"))
-                else:
-                    display_row.append(cell)
 
-            rows.append(display_row)
+def _is_not_modified(wb: ParsedWorkbook, etag: str) -> bool:
+    """
+    Есть ли у клиента актуальная копия ответа. If-None-Match главнее
+    If-Modified-Since: по второму смотрим, только если первого нет.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since is not None:
+        return _last_modified(wb) <= request.if_modified_since
+    return False
 
-        numeric_indices = [idx for idx, is_num in enumerate(numeric_flags) if is_num]
 
-        block: dict = {
-            "id": sheet_name,
-            "title": sheet_name,
-            "sheetName": sheet_name,
-            "columns": columns,
-            "rows": rows,
-            "numericColumns": numeric_indices,
-        }
+def _with_cache_headers(response, wb: ParsedWorkbook, etag: str):
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    response.last_modified = _last_modified(wb)
+    response.cache_control.public = True
+    response.cache_control.max_age = API_CACHE_MAX_AGE
+    response.cache_control.must_revalidate = True
+    return response
+
+
+def _not_modified_response(wb: ParsedWorkbook, etag: str):
+    return _with_cache_headers(app.response_class(status=304), wb, etag)
+
+
+def _preferred_encoding() -> str:
+    """
+    Кодировка ответа по Accept-Encoding. Без заголовка – без сжатия.
+    """
+    if "Accept-Encoding" not in request.headers:
+        return "identity"
+    return request.accept_encodings.best_match(ENCODINGS, default="identity")
+
+
+def _encode_payload(build_payload) -> dict[str, bytes]:
+    with stage("build"):
+        payload = build_payload()
+    with stage("serialize"):
+        body = jsonify(payload).get_data()
+    with stage("compress"):
+        return encode_body(body)
+
+
+def _build_bodies(etag: str, build_payload) -> dict[str, bytes]:
+    bodies = _response_cache.get(etag)
+    if bodies is None:
+        bodies = _encode_payload(build_payload)
+        _response_cache.put(etag, bodies)
+    return bodies
+
+
+def _count_response_cache(result: str) -> None:
+    _response_cache_requests.inc(result=result)
+    mark(f"cache-{result}")
+
+
+def _cached_json_response(wb: ParsedWorkbook, etag: str, build_payload):
+    """
+    Ответ API из кэша готовых тел (см. response_cache.py).
+
+    Тело сериализуется и сжимается один раз на ETag (версия книги + запрос),
+    дальше отдаётся как есть в кодировке клиента. У сжатых вариантов свой
+    ETag с суффиксом кодировки – это разные байты.
+    """
+    encoding = _preferred_encoding()
+    variant_etag = etag if encoding == "identity" else f"{etag}-{encoding}"
+
+    if g.get("profiler") is not None:
+        # Профилируем саму сборку ответа, а не выдачу из кэша (и не 304)
+        bodies = _encode_payload(build_payload)
+        response = app.response_class(bodies[encoding], mimetype="application/json")
+        if encoding != "identity":
+            response.content_encoding = encoding
+        return _with_cache_headers(response, wb, variant_etag)
+
+    if _is_not_modified(wb, variant_etag):
+        _count_response_cache("not-modified")
+        return _not_modified_response(wb, variant_etag)
+
+    bodies = _response_cache.get(etag)
+    if bodies is None:
+        _count_response_cache("miss")
+        # Одновременные промахи по одному ETag ждут одну сборку, а не делают свою
+        bodies = _body_builds.run(etag, lambda: _build_bodies(etag, build_payload))
+    else:
+        _count_response_cache("hit")
+
+    response = app.response_class(bodies[encoding], mimetype="application/json")
+    if encoding != "identity":
+        response.content_encoding = encoding
+    return _with_cache_headers(response, wb, variant_etag)
+
+
+# ---------------------------- CLI ------------------------------------
+
+
+@app.cli.command("snapshot")
+def snapshot_command():
+    """
+    Разобрать Excel-файл и записать снапшот рядом с ним:
+        flask --app app snapshot
+    """
+    stamp = _file_stamp()
+    content = EXCEL_FILE.read_bytes()
+    wb = _parse_workbook(content, stamp, hashlib.sha1(content).hexdigest())
+    _write_snapshot(wb)
+    click.echo(f"Снапшот записан: {SNAPSHOT_FILE}")
+
+
+@app.cli.command("capture")
+@click.option(
+    "--date",
+    "date_str",
+    default=None,
+    help="YYYY-MM-DD, по умолчанию – последние данные",
+)
+def capture_command(date_str):
+    """
+    Сохранить снимок дашборда, отрисованный на сервере:
+        flask --app app capture --date 2025-12-08
+    """
+    target_date = parse_excel_date(date_str) if date_str else None
+    if date_str and target_date is None:
+        raise click.BadParameter(f"Некорректный формат даты: {date_str}")
+
+    path = capture_dashboard(target_date)
+    click.echo(f"Снимок сохранён: {path}")
+
+
+@app.cli.command("serve")
+@click.option("--host", default=SERVE_HOST, show_default=True)
+@click.option("--port", default=SERVE_PORT, show_default=True, type=int)
+@click.option("--workers", default=SERVE_WORKERS, show_default=True, type=int)
+@click.option("--threads", default=SERVE_THREADS, show_default=True, type=int)
+def serve_command(host, port, workers, threads):
+    """
+    Боевой запуск: gunicorn, несколько воркеров с общим кэшем книги
+    и плавным перезапуском при изменении Excel-файла (см. serve.py):
+        flask --app app serve --workers 4
+    """
+    from serve import run_server
+
+    def on_master_ready(reload_workers):
+        # Книгу отслеживает только мастер: новая версия -> перезапуск воркеров
+        start_workbook_reloader(on_change=lambda wb: reload_workers())
+        start_event_server(host)
+        start_capture_scheduler()
+
+    run_server(app, host, port, workers, threads, on_master_ready)
+
+
+# ------------------------ ЗАМЕРЫ ЗАПРОСОВ ------------------------
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    start_request()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    """
+    Время и размер ответа в метрики; ответам API – Server-Timing с этапами
+    (сборка, сериализация, сжатие, разбор книги, если он случился в запросе).
+    """
+    started = g.pop("request_started", None)
+    stages = finish_request()
+    if started is None:
+        return response
+
+    elapsed = time.perf_counter() - started
+    if METRICS_ENABLED:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        _request_seconds.observe(
+            elapsed, route=route, method=request.method, status=response.status_code
+        )
+        if response.content_length is not None:
+            _response_bytes.observe(
+                response.content_length,
+                route=route,
+                encoding=response.content_encoding or "identity",
+            )
+
+    if SERVER_TIMING and request.path.startswith("/api/"):
+        response.headers["Server-Timing"] = server_timing(stages, elapsed)
+    return response
+
+
+# -------------------- ПРОФИЛИРОВАНИЕ ЗАПРОСОВ --------------------
+
+
+def _has_profile_token() -> bool:
+    """
+    Есть ли в запросе верный токен профилирования: заголовок X-Profile-Token
+    или параметр ?profile=. Без PROFILE_TOKEN в config.py – никогда.
+    """
+    if not PROFILE_TOKEN:
+        return False
+    token = request.headers.get("X-Profile-Token") or request.args.get("profile")
+    return token is not None and hmac.compare_digest(
+        token.encode("utf-8"), PROFILE_TOKEN.encode("utf-8")
+    )
+
+
+@app.before_request
+def _start_request_profile():
+    if request.path.startswith("/api/profiles") or not _has_profile_token():
+        return None
+
+    profiler = start_profile()
+    if profiler is None:
+        return jsonify({"error": "Уже профилируется другой запрос"}), 409
+    g.profiler = profiler
+    g.profile_started = time.perf_counter()
+    return None
 
-        # Для "Конкурентов" дополнительно отправляем вчерашнюю дату и значения
-        if sheet_name == "Конкуренты":
-            block["prevDate"] = prev_date.isoformat() if prev_date else None
-            block["prevValues"] = prev_values or {}
 
-        blocks.append(block)
+@app.after_request
+def _save_request_profile(response):
+    """
+    Остановить профилировщик и сохранить профиль; имя файла – в заголовке
+    X-Profile (скачать: /api/profiles/<имя>).
+    """
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return response
+    stop_profile(profiler)
+
+    meta = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "method": request.method,
+        "path": request.path,
+        # Токен в описание не пишем
+        "query": {k: v for k, v in request.args.items() if k != "profile"},
+        "status": response.status_code,
+        "durationMs": round((time.perf_counter() - g.profile_started) * 1000, 3),
+    }
+    try:
+        response.headers["X-Profile"] = save_profile(
+            profiler, PROFILES_DIR, meta, PROFILE_KEEP_FILES
+        )
+    except OSError:
+        pass
+    return response
 
-    return blocks
+
+@app.teardown_request
+def _drop_request_profile(exc):
+    # Запрос упал до after_request – профилировщик всё равно надо выключить
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        stop_profile(profiler)
 
 
 # ---------------------------- ROUTES ---------------------------------
@@ -422,12 +1879,56 @@ def index():
     return render_template("index.html", **metrics)
 
 
+def _split_names(raw: str | None) -> tuple[str, ...] | None:
+    if raw is None:
+        return None
+    return tuple(name.strip() for name in raw.split(",") if name.strip())
+
+
+def _parse_block_view(args) -> BlockView:
+    """
+    BlockView из параметров запроса; ValueError – некорректное число.
+    """
+    numbers: dict[str, int | None] = {}
+    for name in ("offset", "limit"):
+        raw = args.get(name)
+        if raw is None or raw == "":
+            numbers[name] = None
+            continue
+        try:
+            numbers[name] = int(raw)
+        except ValueError:
+            numbers[name] = -1
+        if numbers[name] < 0:
+            raise ValueError(f"Некорректное значение {name}: {raw}")
+
+    return BlockView(
+        sheets=_split_names(args.get("sheets")),
+        columns=_split_names(args.get("columns")),
+        offset=numbers["offset"] or 0,
+        limit=numbers["limit"],
+    )
+
+
 @app.route("/api/blocks")
 def api_blocks():
     """
     API: отдать блоки.
     Параметр ?date=YYYY-MM-DD — дата, за которую нужно отдать блоки.
     Если не передавать ?date, вернём "последний день" по каждому листу.
+
+    Параметр ?since=<version> — версия книги, блоки которой уже есть у клиента.
+    Если эта версия ещё в памяти, вместо блоков отдаём дельту (см. diff_blocks):
+        {"version", "baseVersion", "delta": true, "sheets", "changes"}.
+    Иначе – полный ответ {"version", "blocks"}.
+
+    Выборка (см. BlockView; с ней since не действует, ответ всегда полный):
+    ?sheets=Лист1,Лист2 – только эти листы (иначе все, кроме скрытых);
+    ?columns=Продукт,Цена – только эти колонки, в этом порядке;
+    ?offset=N&limit=M – страница строк каждого блока.
+
+    Ответ помечается ETag по версии книги и дате; на совпавший If-None-Match
+    отвечаем 304 без сборки блоков. Готовое (и сжатое) тело кэшируется.
     """
     try:
         date_param = request.args.get("date")
@@ -441,8 +1942,214 @@ def api_blocks():
                     400,
                 )
 
-        blocks = load_blocks_from_excel(date_filter=target_date)
-        return jsonify({"blocks": blocks})
+        try:
+            view = _parse_block_view(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        wb = get_parsed_workbook()
+        date_key = target_date.isoformat() if target_date else "latest"
+
+        since = request.args.get("since")
+        base_wb = _workbook_history.get(since) if since else None
+
+        if base_wb is None or view != _DEFAULT_VIEW:
+            etag = _api_etag(wb, "blocks", date_key, *view.etag_parts())
+            return _cached_json_response(
+                wb,
+                etag,
+                lambda: {
+                    "version": wb.version,
+                    "blocks": load_blocks_from_excel(
+                        date_filter=target_date, wb=wb, view=view
+                    ),
+                },
+            )
+
+        def build_delta() -> dict:
+            delta = diff_blocks(
+                load_blocks_from_excel(date_filter=target_date, wb=base_wb),
+                load_blocks_from_excel(date_filter=target_date, wb=wb),
+                wb,
+            )
+            return {
+                "version": wb.version,
+                "baseVersion": base_wb.version,
+                "delta": True,
+                **delta,
+            }
+
+        etag = _api_etag(wb, "blocks", date_key, "since", base_wb.version)
+        return _cached_json_response(wb, etag, build_delta)
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        return jsonify({"error": f"Ошибка при чтении Excel: {e}"}), 500
+
+
+@app.route("/api/blocks/range")
+def api_blocks_range():
+    """
+    API: блоки сразу за несколько дат (для подгрузки соседних дней архива).
+
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD – все даты архива в этом интервале
+        (любую границу можно опустить);
+    ?dates=YYYY-MM-DD,YYYY-MM-DD,... – конкретные даты.
+
+    Ответ: {"version", "dates": [...], "blocksByDate": {"YYYY-MM-DD": [блоки]}},
+    блоки за каждую дату – как у /api/blocks?date=.
+    """
+    try:
+        wb = get_parsed_workbook()
+        dates_param = request.args.get("dates")
+
+        if dates_param:
+            target_dates: list[date] = []
+            for raw in dates_param.split(","):
+                d = parse_excel_date(raw)
+                if d is None:
+                    return (
+                        jsonify({"error": f"Некорректный формат даты: {raw}"}),
+                        400,
+                    )
+                target_dates.append(d)
+            target_dates = sorted(set(target_dates))
+        else:
+            bounds: dict[str, date | None] = {}
+            for name in ("from", "to"):
+                raw = request.args.get(name)
+                bounds[name] = parse_excel_date(raw) if raw else None
+                if raw and bounds[name] is None:
+                    return (
+                        jsonify({"error": f"Некорректный формат даты: {raw}"}),
+                        400,
+                    )
+
+            target_dates = [
+                d
+                for d in reversed(collect_all_dates(wb))
+                if (bounds["from"] is None or d >= bounds["from"])
+                and (bounds["to"] is None or d <= bounds["to"])
+            ]
+
+        if len(target_dates) > MAX_BATCH_DATES:
+            return (
+                jsonify(
+                    {
+                        "error": f"Слишком много дат в запросе: {len(target_dates)}, "
+                        f"максимум {MAX_BATCH_DATES}"
+                    }
+                ),
+                400,
+            )
+
+        dates_str = [d.isoformat() for d in target_dates]
+        etag = _api_etag(wb, "range", *dates_str)
+
+        def build_payload() -> dict:
+            blocks_by_date = load_blocks_for_dates(target_dates, wb=wb)
+            return {
+                "version": wb.version,
+                "dates": dates_str,
+                "blocksByDate": {d.isoformat(): b for d, b in blocks_by_date.items()},
+            }
+
+        return _cached_json_response(wb, etag, build_payload)
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        return jsonify({"error": f"Ошибка при чтении Excel: {e}"}), 500
+
+
+@app.route("/api/series")
+def api_series():
+    """
+    API: история одного значения по всем датам листа (для графиков).
+
+    ?sheet=Лист&key=Продукт&column=Колонка – обязательные;
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD – интервал дат (любую границу можно опустить);
+    ?step=day|week|month&agg=last|avg|min|max – прореживание (см. load_series).
+
+    Ответ: {"version", "sheet", "key", "column", "step", "agg",
+            "points": [[YYYY-MM-DD, значение], ...]}.
+    """
+    try:
+        sheet_name = request.args.get("sheet")
+        key = request.args.get("key")
+        column_name = request.args.get("column")
+        if not sheet_name or key is None or not column_name:
+            return (
+                jsonify({"error": "Нужны параметры sheet, key и column"}),
+                400,
+            )
+        key = key.strip()
+
+        step = request.args.get("step", "day")
+        agg = request.args.get("agg", "last")
+        if step not in _SERIES_STEPS or agg not in _SERIES_AGGS:
+            return (
+                jsonify(
+                    {
+                        "error": f"step – одно из {', '.join(_SERIES_STEPS)}, "
+                        f"agg – одно из {', '.join(_SERIES_AGGS)}"
+                    }
+                ),
+                400,
+            )
+
+        bounds: dict[str, date | None] = {}
+        for name in ("from", "to"):
+            raw = request.args.get(name)
+            bounds[name] = parse_excel_date(raw) if raw else None
+            if raw and bounds[name] is None:
+                return (
+                    jsonify({"error": f"Некорректный формат даты: {raw}"}),
+                    400,
+                )
+
+        wb = get_parsed_workbook()
+        if sheet_name not in wb.headers:
+            return jsonify({"error": f"Нет листа: {sheet_name}"}), 404
+        if not wb.indexes[sheet_name].dates:
+            return jsonify({"error": f"На листе нет дат: {sheet_name}"}), 400
+
+        columns = [str(c) if c is not None else "" for c in wb.headers[sheet_name]]
+        if column_name not in columns:
+            return jsonify({"error": f"Нет колонки: {column_name}"}), 404
+        column = columns.index(column_name)
+
+        etag = _api_etag(
+            wb,
+            "series",
+            sheet_name,
+            key,
+            column_name,
+            *(d.isoformat() if d else "" for d in bounds.values()),
+            step,
+            agg,
+        )
+        return _cached_json_response(
+            wb,
+            etag,
+            lambda: {
+                "version": wb.version,
+                "sheet": sheet_name,
+                "key": key,
+                "column": column_name,
+                "step": step,
+                "agg": agg,
+                "points": load_series(
+                    wb,
+                    sheet_name,
+                    key,
+                    column,
+                    bounds["from"],
+                    bounds["to"],
+                    step,
+                    agg,
+                ),
+            },
+        )
     except FileNotFoundError as e:
         return jsonify({"error": str(e)}), 500
     except Exception as e:
@@ -456,50 +2163,153 @@ def api_dates():
     Возвращаем даты в формате YYYY-MM-DD по убыванию.
     """
     try:
-        dates = collect_all_dates()
-        dates_str = [d.isoformat() for d in dates]
-        return jsonify({"dates": dates_str})
+        wb = get_parsed_workbook()
+        etag = _api_etag(wb, "dates")
+        return _cached_json_response(
+            wb,
+            etag,
+            lambda: {"dates": [d.isoformat() for d in collect_all_dates(wb)]},
+        )
     except FileNotFoundError as e:
         return jsonify({"error": str(e)}), 500
     except Exception as e:
         return jsonify({"error": f"Ошибка при чтении дат из Excel: {e}"}), 500
 
 
+@app.route("/metrics")
+def metrics():
+    """
+    Метрики процесса в текстовом формате Prometheus (см. metrics.py).
+
+    Под gunicorn у каждого воркера свои счётчики: на /metrics отвечает тот
+    воркер, которому достался запрос.
+    """
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Метрики выключены"}), 404
+    return app.response_class(
+        REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.route("/api/profiles")
+def api_profiles():
+    """
+    API: последние профили запросов (новые первыми), нужен токен как у самого
+    профилирования: [{"name", "bytes", "time", "method", "path", "query",
+    "status", "durationMs"}, ...].
+    """
+    if not PROFILE_TOKEN:
+        return jsonify({"error": "Профилирование выключено"}), 404
+    if not _has_profile_token():
+        return jsonify({"error": "Нужен токен профилирования"}), 403
+    return jsonify({"profiles": list_profiles(PROFILES_DIR)})
+
+
+@app.route("/api/profiles/<name>")
+def api_profile_file(name):
+    """
+    API: скачать профиль (pstats) по имени из /api/profiles.
+    """
+    if not PROFILE_TOKEN:
+        return jsonify({"error": "Профилирование выключено"}), 404
+    if not _has_profile_token():
+        return jsonify({"error": "Нужен токен профилирования"}), 403
+    if not PROFILE_NAME_RE.fullmatch(name):
+        return jsonify({"error": f"Нет профиля: {name}"}), 404
+    return send_from_directory(PROFILES_DIR, name, as_attachment=True)
+
+
+@app.route("/api/events")
+def api_events():
+    """
+    API: поток событий (SSE) об обновлении книги:
+        event: version
+        data: {"version": "...", "changedSheets": ["Конкуренты", ...]}
+
+    Сам поток держит отдельный asyncio-сервер (events.py) на EVENTS_PORT,
+    чтобы сотни открытых вкладок не занимали по потоку Flask. Здесь только
+    перенаправляем на него; за reverse proxy /api/events лучше сразу
+    проксировать на этот порт.
+    """
+    if not _events.running:
+        return jsonify({"error": "Канал событий не запущен"}), 503
+
+    host = urlsplit(request.host_url).hostname or "localhost"
+    if ":" in host:
+        host = f"[{host}]"
+    return redirect(f"{request.scheme}://{host}:{EVENTS_PORT}{EVENTS_PATH}", code=307)
+
+
+@app.route("/api/capture", methods=["POST"])
+def api_capture():
+    """
+    Снимок дашборда без браузера (см. capture_dashboard).
+    Параметр ?date=YYYY-MM-DD – дата, по умолчанию последние данные.
+    """
+    try:
+        date_param = request.args.get("date")
+        target_date = parse_excel_date(date_param) if date_param else None
+        if date_param and target_date is None:
+            return jsonify({"error": f"Некорректный формат даты: {date_param}"}), 400
+
+        path = capture_dashboard(target_date)
+        return jsonify({"status": "ok", "fileName": path.name})
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        return jsonify({"error": f"Ошибка при отрисовке снимка: {e}"}), 500
+
+
 @app.route("/api/screenshot", methods=["POST"])
 def api_screenshot():
     """
-    Принимает base64 PNG из фронта и сохраняет его в папку screenshots
+    Принимает PNG из фронта и сохраняет его в папку screenshots
     рядом с Excel-файлом (в структуре проекта).
+
+    Основной вариант – тело запроса и есть картинка (Content-Type: image/png),
+    она пишется на диск кусками по мере чтения. Старый вариант – JSON
+    {"imageData": "data:image/png;base64,..."} – тоже принимается.
+
+    Пережатие (SCREENSHOT_FORMAT) и чистка старых файлов идут в фоне, в ответе
+    имя сохранённого PNG.
     """
     try:
-        payload = request.get_json()
-        if not payload or "imageData" not in payload:
-            return jsonify({"error": "Не переданы данные изображения"}), 400
-
-        image_data = payload["imageData"]
-        if not isinstance(image_data, str) or "," not in image_data:
-            return jsonify({"error": "Неверный формат данных изображения"}), 400
+        if request.content_length and request.content_length > SCREENSHOT_MAX_BYTES:
+            return jsonify({"error": "Скриншот слишком большой"}), 413
 
-        header, b64data = image_data.split(",", 1)
-        if "base64" not in header:
-            return jsonify({"error": "Ожидался base64-формат изображения"}), 400
+        if request.mimetype == "image/png":
+            read = request.stream.read
+        else:
+            payload = request.get_json(silent=True)
+            if not payload or "imageData" not in payload:
+                return jsonify({"error": "Не переданы данные изображения"}), 400
 
-        img_bytes = base64.b64decode(b64data)
+            image_data = payload["imageData"]
+            if not isinstance(image_data, str) or "," not in image_data:
+                return jsonify({"error": "Неверный формат данных изображения"}), 400
 
-        screenshots_dir = EXCEL_FILE.parent / "screenshots"
-        screenshots_dir.mkdir(parents=True, exist_ok=True)
+            header, b64data = image_data.split(",", 1)
+            if "base64" not in header:
+                return jsonify({"error": "Ожидался base64-формат изображения"}), 400
 
-        now = datetime.now()
-        filename = f"trastboard_{now.strftime('%Y-%m-%d_%H-%M-%S')}.png"
-        filepath = screenshots_dir / filename
+            read = BytesIO(base64.b64decode(b64data)).read
 
-        with open(filepath, "wb") as f:
-            f.write(img_bytes)
+        try:
+            filepath = save_stream(read, SCREENSHOTS_DIR, SCREENSHOT_MAX_BYTES)
+        except ScreenshotError as e:
+            return jsonify({"error": str(e)}), 400
 
-        return jsonify({"status": "ok", "fileName": filename})
+        _screenshot_worker.submit(filepath)
+        return jsonify({"status": "ok", "fileName": filepath.name})
     except Exception as e:
         return jsonify({"error": f"Ошибка сохранения скрина: {e}"}), 500
 
 
 if __name__ == "__main__":
+    # С debug=True werkzeug запускает приложение во втором процессе,
+    # перечитыватель и канал событий нужны только там, где обслуживаются запросы
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        # app.run ниже слушает только localhost – канал тоже
+        start_event_server("127.0.0.1")
+        start_capture_scheduler()
     app.run(debug=True)
@@ -0,0 +1,336 @@
+# bench.py
+#
+# Бенчмарк дашборда на синтетической книге.
+#
+# Генерирует xlsx той же формы, что dashboard_data.xlsx (лист «Курсы»,
+# «Конкуренты» с продуктом и датой, N листов с датами, M строк в каждом,
+# даты в разных форматах – datetime и строками), подставляет её приложению
+# вместо настоящей и замеряет:
+#   - разбор книги (в своём процессе и в пуле процессов, как в бою) и загрузку
+#     снапшота;
+#   - функции чтения (load_blocks_from_excel, collect_all_dates,
+#     get_header_metrics, parse_excel_date);
+#   - эндпоинты через тестовый клиент Flask, холодные (пустой кэш ответов),
+#     тёплые и 304 по ETag;
+#   - пиковую память (tracemalloc) каждого замера отдельным проходом; у
+#     разбора в пуле – ещё пиковый RSS дочерних процессов (tracemalloc их
+#     не видит).
+#
+# Результат – JSON (--out), его можно сравнить с прошлым прогоном (--compare):
+#   python bench.py --sheets 8 --rows 20000 --out bench_results.json
+#   python bench.py --compare bench_results.json
+
+from datetime import date, datetime, timedelta
+from pathlib import Path
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # нет на Windows, там без памяти дочерних процессов
+    resource = None
+
+from openpyxl import Workbook
+
+PRODUCTS = ["АИ-92", "АИ-95", "АИ-98", "ДТЛ", "ДТЗ", "ДТА", "М100 1,5%", "RMD-80"]
+COMPETITORS = ["ХТК", "ННК", "СибПром", "АльфаТ", "Биржа", "Газпром", "Аргус"]
+
+# Форматы дат-строк, которые встречаются в реальных книгах
+DATE_FORMATS = ["%d.%m.%Y", "%Y-%m-%d", "%d.%m.%y", "%d/%m/%Y", "%d.%m.%Y г."]
+
+
+# ---------------------- СИНТЕТИЧЕСКАЯ КНИГА ----------------------
+
+
+def _date_cell(rng: random.Random, d: date):
+    # Примерно половина дат – настоящие datetime, остальные – строки
+    if rng.random() < 0.5:
+        return datetime(d.year, d.month, d.day)
+    return d.strftime(rng.choice(DATE_FORMATS))
+
+
+def generate_workbook(
+    path: Path, sheets: int, rows: int, days: int, seed: int = 1
+) -> None:
+    """
+    Записать синтетическую книгу в path: «Курсы» (по строке на день),
+    «Конкуренты» (продукты x дни) и sheets листов по rows строк за days дней.
+    """
+    rng = random.Random(seed)
+    first_day = date(2025, 1, 1)
+    day_list = [first_day + timedelta(days=i) for i in range(days)]
+
+    wb = Workbook(write_only=True)
+
+    ws = wb.create_sheet("Курсы")
+    ws.append(["Дата", "USD", "Brent"])
+    for d in day_list:
+        ws.append(
+            [
+                _date_cell(rng, d),
+                round(rng.uniform(75, 100), 2),
+                round(rng.uniform(60, 90), 2),
+            ]
+        )
+
+    ws = wb.create_sheet("Конкуренты")
+    ws.append(["Дата", "Продукт", *COMPETITORS])
+    for d in day_list:
+        for product in PRODUCTS:
+            prices = [
+                rng.randrange(50_000, 120_000, 100) if rng.random() < 0.8 else "..."
+                for _ in COMPETITORS
+            ]
+            ws.append([_date_cell(rng, d), product, *prices])
+
+    for n in range(sheets):
+        ws = wb.create_sheet(f"Лист {n + 1}")
+        ws.append(["Дата", "Продукт", "Цена, ₽/т", "Объём, т", "Комментарий"])
+        for i in range(rows):
+            d = day_list[i * days // rows]
+            ws.append(
+                [
+                    _date_cell(rng, d),
+                    rng.choice(PRODUCTS),
+                    round(rng.uniform(50_000, 120_000), 2),
+                    rng.randrange(1, 500),
+                    rng.choice(["", "самовывоз", "ж/д", "налив", None]),
+                ]
+            )
+
+    wb.save(path)
+
+
+# ---------------------------- ЗАМЕРЫ ------------------------------------
+
+
+def _measure(name: str, fn, repeat: int, setup=None) -> dict:
+    """
+    repeat прогонов fn (перед каждым – setup), время в мс; затем ещё один
+    прогон под tracemalloc для пиковой памяти.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "name": name,
+        "repeat": repeat,
+        "min_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+        "max_ms": round(max(times), 3),
+        "peak_kb": peak // 1024,
+    }
+
+
+def run_benchmarks(workbook: Path, repeat: int) -> list[dict]:
+    import app as dashboard
+    from response_cache import ResponseCache
+
+    # Приложение читает синтетическую книгу вместо настоящей
+    dashboard.EXCEL_FILE = workbook
+    dashboard.SNAPSHOT_FILE = workbook.with_suffix(".snapshot")
+
+    def cold_workbook():
+        dashboard._workbook_cache = None
+        dashboard._workbook_history.clear()
+        dashboard.SNAPSHOT_FILE.unlink(missing_ok=True)
+
+    def no_cached_workbook():
+        dashboard._workbook_cache = None
+        dashboard._workbook_history.clear()
+
+    def cold_responses():
+        dashboard._response_cache = ResponseCache(dashboard.RESPONSE_CACHE_MAX_BYTES)
+
+    # Разбор в пуле: каждый раз с запуском процессов (пул живёт один разбор),
+    # память самого разбора – только в дочерних процессах. Порог размера
+    # снимаем, иначе небольшая книга разобралась бы без пула
+    dashboard.PARSE_IN_SUBPROCESS = True
+    dashboard.PARSE_SUBPROCESS_MIN_BYTES = 0
+    pool = _measure(
+        "parse_workbook_pool", dashboard._reload_workbook, repeat, cold_workbook
+    )
+    if resource is not None:
+        # ru_maxrss: КБ в Linux, байты в macOS
+        rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        pool["child_peak_rss_kb"] = rss // 1024 if sys.platform == "darwin" else rss
+
+    # Дальше всё в своём процессе: tracemalloc видит всю память разбора
+    dashboard.PARSE_IN_SUBPROCESS = False
+    results = [
+        _measure("parse_workbook", dashboard._reload_workbook, repeat, cold_workbook),
+        pool,
+        _measure(
+            "load_snapshot", dashboard._reload_workbook, repeat, no_cached_workbook
+        ),
+    ]
+
+    wb = dashboard.get_parsed_workbook()
+    dates = dashboard.collect_all_dates(wb)
+    mid_date = dates[len(dates) // 2]
+
+    strings = [
+        (date(2025, 1, 1) + timedelta(days=i % 365)).strftime(
+            DATE_FORMATS[i % len(DATE_FORMATS)]
+        )
+        for i in range(10_000)
+    ]
+
+    def parse_dates():
+        dashboard._parse_date_string.cache_clear()
+        for s in strings:
+            dashboard.parse_excel_date(s)
+
+    results += [
+        _measure(
+            "load_blocks_latest",
+            lambda: dashboard.load_blocks_from_excel(wb=wb),
+            repeat,
+        ),
+        _measure(
+            "load_blocks_date",
+            lambda: dashboard.load_blocks_from_excel(date_filter=mid_date, wb=wb),
+            repeat,
+        ),
+        _measure("collect_all_dates", lambda: dashboard.collect_all_dates(wb), repeat),
+        _measure("get_header_metrics", dashboard.get_header_metrics, repeat),
+        _measure("parse_excel_date_x10000", parse_dates, repeat),
+    ]
+
+    client = dashboard.app.test_client()
+    urls = {
+        "index": "/",
+        "api_blocks": "/api/blocks",
+        "api_blocks_date": f"/api/blocks?date={mid_date.isoformat()}",
+        "api_dates": "/api/dates",
+        "api_blocks_range": "/api/blocks/range?from="
+        f"{dates[min(6, len(dates) - 1)].isoformat()}&to={dates[0].isoformat()}",
+        "api_series": "/api/series?sheet=Конкуренты&key=ДТЗ&column=Биржа",
+    }
+
+    for name, url in urls.items():
+
+        def get(url=url):
+            response = client.get(url, headers={"Accept-Encoding": "gzip"})
+            assert response.status_code == 200, (url, response.status_code)
+
+        results.append(_measure(f"{name}_cold", get, repeat, cold_responses))
+        results.append(_measure(f"{name}_warm", get, repeat))
+
+        etag = client.get(url).headers.get("ETag")
+        if etag:
+
+            def revalidate(url=url, etag=etag):
+                response = client.get(url, headers={"If-None-Match": etag})
+                assert response.status_code == 304, (url, response.status_code)
+
+            results.append(_measure(f"{name}_304", revalidate, repeat))
+
+    return results
+
+
+# ---------------------------- ОТЧЁТ ------------------------------------
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: list[dict], baseline: dict | None = None) -> None:
+    base = {r["name"]: r for r in baseline["results"]} if baseline else {}
+    print(
+        f"{'замер':<28}{'медиана, мс':>14}{'мин, мс':>12}{'пик, КБ':>12}{'к прошлому':>14}"
+    )
+    for r in results:
+        ratio = ""
+        old = base.get(r["name"])
+        if old and old["median_ms"]:
+            ratio = f"x{r['median_ms'] / old['median_ms']:.2f}"
+        print(
+            f"{r['name']:<28}{r['median_ms']:>14.3f}{r['min_ms']:>12.3f}"
+            f"{r['peak_kb']:>12}{ratio:>14}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Бенчмарк дашборда на синтетической книге"
+    )
+    parser.add_argument("--sheets", type=int, default=4, help="листов с датами")
+    parser.add_argument("--rows", type=int, default=5000, help="строк на листе")
+    parser.add_argument("--days", type=int, default=90, help="разных дат")
+    parser.add_argument("--repeat", type=int, default=5, help="прогонов каждого замера")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", type=Path, help="куда записать результаты (JSON)")
+    parser.add_argument("--compare", type=Path, help="прошлые результаты для сравнения")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workbook = Path(tmp) / "bench_data.xlsx"
+        start = time.perf_counter()
+        generate_workbook(workbook, args.sheets, args.rows, args.days, args.seed)
+        print(
+            f"Книга: {args.sheets} листов x {args.rows} строк, {args.days} дат, "
+            f"{workbook.stat().st_size // 1024} КБ "
+            f"(сгенерирована за {time.perf_counter() - start:.1f} с)",
+            file=sys.stderr,
+        )
+        results = run_benchmarks(workbook, args.repeat)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {
+                "sheets": args.sheets,
+                "rows": args.rows,
+                "days": args.days,
+                "repeat": args.repeat,
+                "seed": args.seed,
+            },
+        },
+        "results": results,
+    }
+
+    baseline = json.loads(args.compare.read_text("utf-8")) if args.compare else None
+    print_results(results, baseline)
+
+    if args.out:
+        args.out.write_text(json.dumps(report, ensure_ascii=False, indent=2), "utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,111 @@
 # config.py
 
 from pathlib import Path
+import os
 
 # Путь к Excel-файлу с данными для дашборда.
 # Для начала кладём файл рядом с app.py под именем "dashboard_data.xlsx".
 BASE_DIR = Path(__file__).resolve().parent
 EXCEL_FILE = BASE_DIR / "dashboard_data.xlsx"
 
+# Колоночный снапшот разобранной книги (пересобирается сам при смене xlsx,
+# вручную: flask --app app snapshot).
+SNAPSHOT_FILE = EXCEL_FILE.with_suffix(".snapshot")
+
+# Разбирать xlsx в отдельном процессе, чтобы openpyxl не держал GIL
+# процесса, который обслуживает запросы.
+PARSE_IN_SUBPROCESS = True
+
+# Сколько процессов разбирают листы книги параллельно (листы делятся между
+# ними поровну).
+PARSE_WORKERS = min(os.cpu_count() or 1, 4)
+
+# Книги меньше этого размера (байт xlsx) разбираются в своём процессе: запуск
+# пула стоит сотни миллисекунд, дольше, чем разбор маленькой книги.
+PARSE_SUBPROCESS_MIN_BYTES = 1024 * 1024
+
+# Как часто (в секундах) фоновый поток проверяет, не изменился ли Excel-файл.
+RELOAD_INTERVAL_SECONDS = 2.0
+
+# max-age (в секундах) для ответов /api/blocks и /api/dates. При 0 браузер и
+# прокси каждый раз переспрашивают сервер по ETag и получают 304, пока книга
+# не изменилась.
+API_CACHE_MAX_AGE = 0
+
+# По какой колонке узнаются строки листа (продукт), когда сравниваем день с
+# предыдущим днём и строим дельты: первая колонка, в названии которой есть
+# одна из этих подстрок. Если такой нет – первая колонка листа.
+ROW_KEY_COLUMN_NAMES = ("продукт", "номенклат")
+
+# Листы, которые API не отдаёт блоками (курсы показываются в шапке).
+# Через ?sheets= в /api/blocks их всё равно можно запросить явно.
+HIDDEN_SHEET_NAMES = ("Курсы",)
+
+# Сколько дат максимум можно запросить за раз в /api/blocks/range.
+MAX_BATCH_DATES = 62
+
+# Сколько последних версий книги держать в памяти для дельт /api/blocks?since=.
+WORKBOOK_HISTORY_SIZE = 4
+
+# Сколько байт готовых (сериализованных и сжатых) ответов API держать в памяти.
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Боевой запуск (flask --app app serve): адрес, число воркеров gunicorn
+# и потоков в каждом.
+SERVE_HOST = "0.0.0.0"
+SERVE_PORT = 8000
+SERVE_WORKERS = 4
+SERVE_THREADS = 4
+
+# Канал событий об обновлении книги (SSE). Обслуживается отдельным
+# asyncio-сервером на своём порту, Flask перенаправляет /api/events туда –
+# браузер подключается к нему напрямую, поэтому слушать он должен там же,
+# где и сам сайт. None – на том же адресе, что и HTTP-сервер (serve --host).
+EVENTS_HOST = None
+# None – канал выключен, дашборды сами опрашивают сервер (раз в минуту)
+EVENTS_PORT = 5001
+EVENTS_PATH = "/api/events"
+# Раз в сколько секунд слать пустой комментарий, чтобы прокси не рвали соединение.
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# Скриншоты дашборда (кнопка «Скрин»): куда сохранять и сколько максимум
+# принимать за раз.
+SCREENSHOTS_DIR = EXCEL_FILE.parent / "screenshots"
+SCREENSHOT_MAX_BYTES = 64 * 1024 * 1024
+# Во что пережимать в фоне: "webp", "png" (оптимизированный) или None –
+# оставить как прислали. Нужен Pillow, без него файлы остаются как есть.
+# С "webp" файл после ответа меняет расширение: имя .png, которое вернул
+# /api/screenshot, перестаёт существовать.
+SCREENSHOT_FORMAT = None
+# Сколько скриншотов хранить: не больше стольких самых свежих и не старше
+# стольких дней (0 – без ограничения).
+SCREENSHOT_KEEP_FILES = 500
+SCREENSHOT_KEEP_DAYS = 90
+# Во сколько (ЧЧ:ММ, местное время) каждый день сохранять снимок дашборда,
+# отрисованный на сервере (SVG, без браузера). Пустой кортеж – не сохранять.
+CAPTURE_AT = ("19:00",)
+
+# Сколько разных строк-дат помнить в кэше парсера дат (LRU).
+DATE_PARSE_CACHE_SIZE = 4096
+
+# По скольким первым строкам листа ищем дата-колонку.
+DATE_DETECT_SAMPLE_ROWS = 200
+
+# Метрики процесса на /metrics (текстовый формат Prometheus).
+METRICS_ENABLED = True
+# Заголовок Server-Timing у ответов API: время сборки, сериализации, сжатия
+# и т.п. (видно во вкладке Network в браузере).
+SERVER_TIMING = True
+
+# Профиль одного запроса (cProfile): запрос с заголовком X-Profile-Token или
+# параметром ?profile=, равным этому токену, выполняется под профилировщиком,
+# профиль сохраняется в PROFILES_DIR (список – /api/profiles с тем же токеном).
+# Без токена (None) профилирование выключено.
+PROFILE_TOKEN = os.environ.get("TRASTBOARD_PROFILE_TOKEN")
+PROFILES_DIR = EXCEL_FILE.parent / "profiles"
+# Сколько последних профилей хранить.
+PROFILE_KEEP_FILES = 50
+
 # Здесь можно позже добавить другие настройки:
 # - дефолтный порядок блоков
 # - маппинг "лист -> тип блока"
@@ -0,0 +1,132 @@
+# events.py
+#
+# Канал Server-Sent Events: сообщаем открытым дашбордам, что книга обновилась.
+#
+# Соединения SSE висят часами и почти всё время молчат, поэтому держим их не во
+# Flask (там это поток на клиента), а в отдельном asyncio-сервере в одном
+# фоновом потоке: сотни подключений стоят одну корутину каждое.
+
+import asyncio
+import json
+import threading
+
+
+class EventServer:
+    """
+    Минимальный HTTP-сервер для одного пути с потоком событий.
+
+    publish() можно звать из любого потока: последнее событие запоминается,
+    отдаётся каждому новому клиенту сразу после подключения и рассылается всем
+    подключённым. Важно только последнее состояние, поэтому медленный клиент
+    не копит очередь, а просто получает свежее событие.
+    """
+
+    def __init__(self, path: str, keepalive_seconds: float):
+        self.path = path
+        self.keepalive_seconds = keepalive_seconds
+        self._last: bytes | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeups: set[asyncio.Event] = set()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    @property
+    def clients(self) -> int:
+        return len(self._wakeups)
+
+    def publish(self, event: str, data: dict) -> None:
+        payload = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        self._last = payload.encode("utf-8")
+
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._wake_all)
+
+    def start(self, host: str, port: int) -> None:
+        """
+        Запустить сервер в фоновом потоке (повторный вызов ничего не делает).
+        Возвращается, когда порт уже слушается.
+        """
+        if self._thread is not None:
+            return
+
+        ready = threading.Event()
+        errors: list[BaseException] = []
+
+        def run() -> None:
+            try:
+                asyncio.run(self._serve(host, port, ready))
+            except BaseException as e:
+                errors.append(e)
+                ready.set()
+
+        thread = threading.Thread(target=run, name="sse-events", daemon=True)
+        thread.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+        self._thread = thread
+
+    def _wake_all(self) -> None:
+        for wakeup in self._wakeups:
+            wakeup.set()
+
+    async def _serve(self, host: str, port: int, ready: threading.Event) -> None:
+        self._loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._handle, host, port)
+        ready.set()
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        wakeup = asyncio.Event()
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            method, target, *_ = head.split(b"\r\n", 1)[0].decode("latin-1").split()
+            if method != "GET" or target.split("?", 1)[0] != self.path:
+                writer.write(
+                    b"HTTP/1.1 404 Not Found\r\n"
+                    b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+                )
+                await writer.drain()
+                return
+
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/event-stream; charset=utf-8\r\n"
+                b"Cache-Control: no-cache\r\n"
+                b"Connection: keep-alive\r\n"
+                b"Access-Control-Allow-Origin: *\r\n"
+                b"X-Accel-Buffering: no\r\n"
+                b"\r\n"
+            )
+            if self._last is not None:
+                writer.write(self._last)
+            await writer.drain()
+
+            self._wakeups.add(wakeup)
+            while True:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    # комментарий SSE: держит соединение живым через прокси
+                    writer.write(b": ping\n\n")
+                else:
+                    wakeup.clear()
+                    writer.write(self._last or b"")
+                await writer.drain()
+        except (
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ConnectionError,
+            ValueError,
+        ):
+            pass
+        finally:
+            self._wakeups.discard(wakeup)
+            writer.close()
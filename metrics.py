@@ -0,0 +1,324 @@
+# metrics.py
+#
+# Метрики процесса в текстовом формате Prometheus (/metrics) и время этапов
+# запроса для заголовка Server-Timing.
+#
+# Без сторонних библиотек: счётчик или гистограмма – словарь под своей
+# блокировкой, запись – поиск корзины и пара сложений, так что замеры можно
+# держать включёнными в бою. Каждый процесс (воркер gunicorn) считает своё.
+#
+# Этап (stage) – кусок работы внутри запроса или перечитывания книги:
+# разбор xlsx, сборка блоков, сериализация JSON и т.п. Время этапа идёт в
+# гистограмму dashboard_stage_seconds и, если этап случился внутри запроса,
+# в список этапов этого запроса (из него собирается Server-Timing).
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+import math
+import os
+import threading
+import time
+
+# Границы корзин гистограмм: секунды и байты
+TIME_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+SIZE_BUCKETS = tuple(256 * 4**i for i in range(9))  # 256 Б .. 16 МБ
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def _reset_lock(self) -> None:
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """
+    Растущий счётчик: counter.inc(route="/api/blocks").
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return super().render() + [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(v)}"
+            for key, v in items
+        ]
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма с фиксированными корзинами: histogram.observe(0.012, stage="x").
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = TIME_BUCKETS,
+    ):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+        # Ключ меток -> [счётчики корзин (последняя – +Inf), сумма]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][slot] += 1
+            entry[1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            )
+
+        lines = super().render()
+        bounds = [*map(_format_value, self.buckets), "+Inf"]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Collected(_Metric):
+    """
+    Значения, которые считаются в момент выдачи /metrics: collect() отдаёт
+    [(значения меток, число), ...]. Для того, что и так где-то хранится
+    (размер кэша, возраст книги), – без лишней записи на каждый запрос.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        collect,
+        labels: tuple[str, ...] = (),
+        kind: str = "gauge",
+    ):
+        super().__init__(name, help_text, labels)
+        self.kind = kind
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        return super().render() + [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(v)}"
+            for key, v in self.collect()
+        ]
+
+
+class Registry:
+    """
+    Набор метрик процесса; render() – текст для /metrics.
+    """
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+        # Форк мог случиться, пока блокировку метрики держал другой поток
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_locks)
+
+    def _reset_locks(self) -> None:
+        for metric in self._metrics:
+            metric._reset_lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels=()) -> Counter:
+        return self.register(Counter(name, help_text, tuple(labels)))
+
+    def histogram(
+        self, name: str, help_text: str, labels=(), buckets=TIME_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, help_text, tuple(labels), buckets))
+
+    def collected(
+        self, name: str, help_text: str, collect, labels=(), kind="gauge"
+    ) -> Collected:
+        return self.register(Collected(name, help_text, collect, tuple(labels), kind))
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            try:
+                lines += metric.render()
+            except Exception:
+                # Одна сломанная метрика не должна ронять всю выдачу
+                continue
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "dashboard_stage_seconds",
+    "Время этапов разбора книги и сборки ответов",
+    ("stage",),
+)
+
+
+# ---------------------- ЭТАПЫ ЗАПРОСА ----------------------
+
+
+# Этапы текущего запроса: [(имя, секунды или None – просто отметка), ...].
+# None – вне запроса (фоновый поток), тогда этапы идут только в гистограмму.
+_request_stages: ContextVar[list | None] = ContextVar("request_stages", default=None)
+
+
+def start_request() -> None:
+    """
+    Начать сбор этапов для текущего запроса (before_request).
+    """
+    _request_stages.set([])
+
+
+def finish_request() -> list[tuple[str, float | None]]:
+    """
+    Этапы текущего запроса; сбор после этого выключается (teardown).
+    """
+    stages = _request_stages.get() or []
+    _request_stages.set(None)
+    return stages
+
+
+def record_stage(name: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=name)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+
+def mark(name: str) -> None:
+    """
+    Отметка без времени в Server-Timing текущего запроса (например, cache-hit).
+    """
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, None))
+
+
+@contextmanager
+def stage(name: str):
+    """
+    with stage("serialize"): ... – замерить этап (см. record_stage).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+class StageClock:
+    """
+    Суммы времени по этапам без записи в метрики – для работы в другом
+    процессе (пул разбора): там копим сюда, totals возвращаем вместе с
+    результатом, а в метрики их пишет родитель (record_stage).
+    """
+
+    def __init__(self):
+        self.totals: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+
+
+def server_timing(stages: list[tuple[str, float | None]], total: float) -> str:
+    """
+    Значение заголовка Server-Timing: этапы с одним именем складываются,
+    в конце – total (всё время запроса).
+    """
+    merged: dict[str, float | None] = {}
+    for name, seconds in stages:
+        if seconds is None:
+            merged.setdefault(name, None)
+        else:
+            merged[name] = (merged.get(name) or 0.0) + seconds
+
+    parts = [
+        name if seconds is None else f"{name};dur={seconds * 1000:.2f}"
+        for name, seconds in merged.items()
+    ]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
@@ -0,0 +1,111 @@
+# profiling.py
+#
+# Профиль одного запроса по требованию: запрос с токеном (см. PROFILE_TOKEN
+# в config.py) выполняется под cProfile, профиль (pstats) сохраняется в папку
+# профилей рядом с описанием запроса. Хранится несколько последних.
+#
+# Профиль открывается как обычно:
+#   python -m pstats profile_2025-12-08_10-15-42_123456.pstats
+#   snakeviz profile_2025-12-08_10-15-42_123456.pstats
+#
+# cProfile в процессе может работать только один, поэтому одновременно
+# профилируется один запрос; остальные в это время получают отказ.
+
+from datetime import datetime
+from pathlib import Path
+import cProfile
+import json
+import os
+import re
+import threading
+
+FILE_PREFIX = "profile_"
+PROFILE_SUFFIX = ".pstats"
+META_SUFFIX = ".json"
+
+# Имена, которые мы сами и создаём (для выдачи файла по имени из запроса)
+PROFILE_NAME_RE = re.compile(r"profile_[0-9_-]+\.pstats")
+
+_busy = threading.Lock()
+
+
+def _reset_after_fork() -> None:
+    global _busy
+    _busy = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def start_profile() -> cProfile.Profile | None:
+    """
+    Включить профилировщик для текущего потока; None – уже идёт другой профиль.
+    """
+    if not _busy.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Профилировщик уже поставил кто-то другой (отладчик и т.п.)
+        _busy.release()
+        return None
+    return profiler
+
+
+def stop_profile(profiler: cProfile.Profile) -> None:
+    profiler.disable()
+    _busy.release()
+
+
+def save_profile(
+    profiler: cProfile.Profile, directory: Path, meta: dict, keep: int
+) -> str:
+    """
+    Записать профиль и описание запроса (meta) в directory, оставить keep
+    последних профилей. Возвращает имя файла профиля.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    stem = FILE_PREFIX + datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")
+
+    profiler.dump_stats(directory / (stem + PROFILE_SUFFIX))
+    (directory / (stem + META_SUFFIX)).write_text(
+        json.dumps(meta, ensure_ascii=False), encoding="utf-8"
+    )
+
+    prune_profiles(directory, keep)
+    return stem + PROFILE_SUFFIX
+
+
+def _profile_paths(directory: Path) -> list[Path]:
+    # Имена начинаются со времени – сортировка по имени и есть по времени
+    return sorted(directory.glob(FILE_PREFIX + "*" + PROFILE_SUFFIX), reverse=True)
+
+
+def prune_profiles(directory: Path, keep: int) -> None:
+    """
+    Удалить всё, кроме keep самых свежих профилей (вместе с описаниями).
+    """
+    for path in _profile_paths(directory)[keep:]:
+        path.unlink(missing_ok=True)
+        path.with_suffix(META_SUFFIX).unlink(missing_ok=True)
+
+
+def list_profiles(directory: Path) -> list[dict]:
+    """
+    Профили в directory, новые первыми: имя файла, размер и описание запроса.
+    """
+    if not directory.exists():
+        return []
+
+    profiles = []
+    for path in _profile_paths(directory):
+        try:
+            size = path.stat().st_size
+            meta = json.loads(path.with_suffix(META_SUFFIX).read_text("utf-8"))
+        except (OSError, ValueError):
+            # Описание не записалось или файл уже удалила чистка
+            continue
+        profiles.append({"name": path.name, "bytes": size, **meta})
+    return profiles
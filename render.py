@@ -0,0 +1,205 @@
+# render.py
+#
+# Серверная отрисовка дашборда в SVG – без браузера и html2canvas, прямо из
+# готовых блоков (как их отдаёт /api/blocks). Нужна для скриншотов по
+# расписанию: одна отрисовка на версию книги вместо растеризации DOM у
+# каждого пользователя.
+#
+# Вёрстка упрощённая: шапка с курсами и датой, под ней карточки листов по
+# одной в ряд. Ширина колонок оценивается по длине текста (SVG не умеет
+# мерить текст сам).
+
+from xml.sax.saxutils import escape, quoteattr
+
+# Цвета и размеры – как в static/css/styles.css
+BG_APP = "#e1e5eb"
+BG_CARD = "#ffffff"
+BORDER = "#e5e7eb"
+TEXT_MAIN = "#111827"
+TEXT_MUTED = "#6b7280"
+FONT = 'system-ui, -apple-system, "Segoe UI", sans-serif'
+
+FONT_SIZE = 13
+CHAR_WIDTH = FONT_SIZE * 0.6
+ROW_HEIGHT = 24
+CELL_PADDING = 10
+PAGE_PADDING = 24
+CARD_GAP = 16
+CARD_HEADER = 40
+HEADER_HEIGHT = 72
+MIN_WIDTH = 720
+
+
+def format_cell(value) -> str:
+    """
+    Текст ячейки как на странице (formatNumberWithSpaces в main.js):
+    разряды через пробел, дробная часть через запятую.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+
+    int_part, _, frac_part = str(value).partition(".")
+    sign = "-" if int_part.startswith("-") else ""
+    digits = int_part.lstrip("-")
+    groups = []
+    while len(digits) > 3:
+        groups.insert(0, digits[-3:])
+        digits = digits[:-3]
+    groups.insert(0, digits)
+
+    text = sign + " ".join(groups)
+    return f"{text},{frac_part}" if frac_part else text
+
+
+def _text(x: float, y: float, text: str, **attrs) -> str:
+    extra = "".join(
+        f" {k.replace('_', '-')}={quoteattr(str(v))}" for k, v in attrs.items()
+    )
+    return f'<text x="{x:.1f}" y="{y:.1f}"{extra}>{escape(text)}</text>'
+
+
+def _table(
+    block: dict, skip_column: int | None
+) -> tuple[list[str], list[list[str]], set[int]]:
+    """
+    Заголовки, строки (уже текстом) и номера числовых колонок для карточки.
+    """
+    visible = [j for j in range(len(block["columns"])) if j != skip_column]
+    numeric = set(block.get("numericColumns", []))
+
+    header = [block["columns"][j] for j in visible]
+    rows = [
+        [format_cell(row[j]) if j < len(row) else "" for j in visible]
+        for row in block["rows"]
+    ]
+    return header, rows, {k for k, j in enumerate(visible) if j in numeric}
+
+
+def render_dashboard_svg(
+    title: str,
+    date_label: str,
+    metrics: dict,
+    blocks: list[tuple[dict, int | None]],
+) -> bytes:
+    """
+    SVG дашборда.
+
+    metrics – {"usd_rate", "brent_price"} (см. get_header_metrics);
+    blocks  – (блок, номер дата-колонки, которую не показываем, или None).
+    """
+    tables = [(block, *_table(block, skip)) for block, skip in blocks]
+
+    # Ширина каждой колонки – по самому длинному тексту в ней
+    layouts = []
+    width = MIN_WIDTH
+    for block, header, rows, numeric in tables:
+        col_widths = [
+            max(len(text) for text in [name, *(row[k] for row in rows)]) * CHAR_WIDTH
+            + 2 * CELL_PADDING
+            for k, name in enumerate(header)
+        ]
+        layouts.append((block, header, rows, numeric, col_widths))
+        width = max(width, sum(col_widths) + 2 * PAGE_PADDING)
+
+    card_width = width - 2 * PAGE_PADDING
+    parts: list[str] = []
+
+    # ---------- Шапка ----------
+    y = PAGE_PADDING
+    parts.append(
+        f'<rect x="{PAGE_PADDING}" y="{y}" width="{card_width:.1f}" '
+        f'height="{HEADER_HEIGHT}" rx="8" fill="{BG_CARD}" stroke="{BORDER}"/>'
+    )
+    parts.append(
+        _text(
+            PAGE_PADDING + 16,
+            y + 30,
+            title,
+            font_size=22,
+            font_weight="bold",
+            fill=TEXT_MAIN,
+        )
+    )
+    rates = (
+        f"USD {metrics.get('usd_rate') or '—'}    "
+        f"BRENT {metrics.get('brent_price') or '—'}    "
+        f"Дата обновления: {date_label or '—'}"
+    )
+    parts.append(
+        _text(PAGE_PADDING + 16, y + 55, rates, font_size=FONT_SIZE, fill=TEXT_MUTED)
+    )
+    y += HEADER_HEIGHT + CARD_GAP
+
+    # ---------- Карточки листов ----------
+    for block, header, rows, numeric, col_widths in layouts:
+        body_rows = max(len(rows), 1)
+        card_height = CARD_HEADER + ROW_HEIGHT * (body_rows + 1) + CELL_PADDING
+        parts.append(
+            f'<rect x="{PAGE_PADDING}" y="{y}" width="{card_width:.1f}" '
+            f'height="{card_height}" rx="8" fill="{BG_CARD}" stroke="{BORDER}"/>'
+        )
+        parts.append(
+            _text(
+                PAGE_PADDING + 16,
+                y + 26,
+                block.get("title") or block["sheetName"],
+                font_size=16,
+                font_weight="bold",
+                fill=TEXT_MAIN,
+            )
+        )
+
+        row_y = y + CARD_HEADER
+        if not rows or not header:
+            parts.append(
+                _text(
+                    PAGE_PADDING + 16,
+                    row_y + 17,
+                    "Нет данных на этом листе (или нет строк для выбранной даты).",
+                    font_size=FONT_SIZE,
+                    fill=TEXT_MUTED,
+                )
+            )
+        else:
+            for r, cells in enumerate([header, *rows]):
+                cell_x = PAGE_PADDING
+                if r > 0:
+                    parts.append(
+                        f'<line x1="{PAGE_PADDING}" x2="{PAGE_PADDING + card_width:.1f}" '
+                        f'y1="{row_y}" y2="{row_y}" stroke="{BORDER}"/>'
+                    )
+                for k, text in enumerate(cells):
+                    right = k in numeric and r > 0
+                    x = cell_x + (
+                        col_widths[k] - CELL_PADDING if right else CELL_PADDING
+                    )
+                    parts.append(
+                        _text(
+                            x,
+                            row_y + 17,
+                            text,
+                            font_size=FONT_SIZE,
+                            font_weight="bold" if r == 0 or k == 0 else "normal",
+                            fill=TEXT_MUTED if r == 0 else TEXT_MAIN,
+                            text_anchor="end" if right else "start",
+                        )
+                    )
+                    cell_x += col_widths[k]
+                row_y += ROW_HEIGHT
+
+        y += card_height + CARD_GAP
+
+    height = y - CARD_GAP + PAGE_PADDING
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" '
+        f'height="{height:.0f}" viewBox="0 0 {width:.0f} {height:.0f}" '
+        f"font-family={quoteattr(FONT)}>"
+        f'<rect width="100%" height="100%" fill="{BG_APP}"/>'
+        + "".join(parts)
+        + "</svg>"
+    )
+    return svg.encode("utf-8")
@@ -0,0 +1,128 @@
+# response_cache.py
+#
+# Кэш готовых тел ответов API: JSON уже сериализован и сжат под каждую
+# поддерживаемую кодировку, повторный запрос – поиск в словаре и запись.
+
+from collections import OrderedDict
+from concurrent.futures import Future
+import gzip
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:  # brotli не обязателен, без него отдаём gzip
+    brotli = None
+
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Кодировки в порядке предпочтения сервера
+ENCODINGS = ("br", "gzip", "identity") if brotli is not None else ("gzip", "identity")
+
+
+def encode_body(body: bytes) -> dict[str, bytes]:
+    """
+    Тело ответа во всех поддерживаемых кодировках: {"identity": ..., "gzip": ...}.
+    """
+    bodies = {"identity": body, "gzip": gzip.compress(body, GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return bodies
+
+
+class ResponseCache:
+    """
+    LRU-кэш закодированных тел, ограниченный суммарным размером в байтах.
+    Ключ – ETag ответа (в нём уже есть версия книги), значение – encode_body().
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[str, dict[str, bytes]] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._total = 0
+        self._lock = threading.Lock()
+
+        # После форка (воркеры gunicorn) блокировка могла остаться занятой
+        # потоком, которого в дочернем процессе нет
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self) -> None:
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def get(self, key: str) -> dict[str, bytes] | None:
+        with self._lock:
+            bodies = self._items.get(key)
+            if bodies is not None:
+                self._items.move_to_end(key)
+            return bodies
+
+    def put(self, key: str, bodies: dict[str, bytes]) -> None:
+        size = sum(len(b) for b in bodies.values())
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._items:
+                self._total -= self._sizes.pop(key)
+                del self._items[key]
+
+            self._items[key] = bodies
+            self._sizes[key] = size
+            self._total += size
+
+            while self._total > self.max_bytes:
+                old_key, _ = self._items.popitem(last=False)
+                self._total -= self._sizes.pop(old_key)
+
+
+class SingleFlight:
+    """
+    Склейка одинаковых вычислений: пока run(key, fn) для ключа выполняется,
+    остальные вызовы с тем же ключом ждут и получают тот же результат
+    (или то же исключение), а не запускают fn ещё раз.
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, fn):
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
@@ -0,0 +1,371 @@
+# rowtable.py
+#
+# Компактное хранение строк листа в памяти: по колонкам, без кортежа и
+# отдельного объекта на каждую ячейку. В памяти держится несколько версий
+# книги сразу (история для дельт), так что размер строк важен.
+#
+# Колонка выбирается по её содержимому:
+#   - числа (int/float и пустые)  -> array('d') + байт типа на ячейку;
+#   - даты (date/datetime и пустые) -> порядковые номера в array('q'),
+#     подпись YYYY-MM-DD готовится один раз на каждый день;
+#   - всё остальное               -> словарь различных значений + коды.
+#
+# Текст, который уйдёт на фронт (display), считается при построении таблицы,
+# а не на каждый запрос.
+
+from array import array
+from datetime import date, datetime, timedelta
+
+# Типы ячеек числовой и дата-колонки
+_NONE, _INT, _FLOAT = 0, 1, 2
+_DATE, _DATETIME = 1, 2
+
+# int дальше 2**53 в double не помещается точно – такая колонка идёт в общую
+_MAX_EXACT_INT = 2**53
+
+_EPOCH = datetime(1, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class _NumberColumn:
+    __slots__ = ("kinds", "values")
+
+    def __init__(self, cells: list):
+        self.kinds = bytearray(len(cells))
+        self.values = array("d", bytes(8 * len(cells)))
+        for i, cell in enumerate(cells):
+            if cell is None:
+                continue
+            self.kinds[i] = _FLOAT if isinstance(cell, float) else _INT
+            self.values[i] = cell
+
+    @staticmethod
+    def accepts(cells: list) -> bool:
+        for cell in cells:
+            if cell is None or type(cell) is float:
+                continue
+            if type(cell) is not int or abs(cell) > _MAX_EXACT_INT:
+                return False
+        return True
+
+    def slice(self, lo: int, hi: int) -> list:
+        return [
+            None if kind == _NONE else (int(value) if kind == _INT else value)
+            for kind, value in zip(self.kinds[lo:hi], self.values[lo:hi])
+        ]
+
+    display = slice
+
+    def has_numbers(self, lo: int, hi: int) -> bool:
+        return any(self.kinds[lo:hi])
+
+    def find(self, match) -> list[int]:
+        return [
+            i for i, cell in enumerate(self.slice(0, len(self.kinds))) if match(cell)
+        ]
+
+    def numbers(self, rows: list[int]) -> list:
+        kinds, values = self.kinds, self.values
+        return [
+            (
+                None
+                if kinds[i] == _NONE
+                else (int(values[i]) if kinds[i] == _INT else values[i])
+            )
+            for i in rows
+        ]
+
+    def __eq__(self, other):
+        return (
+            type(other) is _NumberColumn
+            and self.kinds == other.kinds
+            and self.values == other.values
+        )
+
+
+class _DateColumn:
+    __slots__ = ("kinds", "values", "labels")
+
+    def __init__(self, cells: list, display):
+        self.kinds = bytearray(len(cells))
+        self.values = array("q", bytes(8 * len(cells)))
+        self.labels: list = [None] * len(cells)
+
+        labels_by_day: dict[int, object] = {}
+        for i, cell in enumerate(cells):
+            if cell is None:
+                continue
+            if isinstance(cell, datetime):
+                self.kinds[i] = _DATETIME
+                self.values[i] = (cell - _EPOCH) // _MICROSECOND
+                day = cell.toordinal()
+            else:
+                self.kinds[i] = _DATE
+                self.values[i] = day = cell.toordinal()
+
+            label = labels_by_day.get(day)
+            if label is None:
+                label = labels_by_day[day] = display(date.fromordinal(day))
+            self.labels[i] = label
+
+    @staticmethod
+    def accepts(cells: list) -> bool:
+        for cell in cells:
+            if cell is None or type(cell) is date:
+                continue
+            if type(cell) is not datetime or cell.tzinfo is not None:
+                return False
+        return True
+
+    def slice(self, lo: int, hi: int) -> list:
+        cells: list = []
+        for kind, value in zip(self.kinds[lo:hi], self.values[lo:hi]):
+            if kind == _NONE:
+                cells.append(None)
+            elif kind == _DATE:
+                cells.append(date.fromordinal(value))
+            else:
+                cells.append(_EPOCH + timedelta(microseconds=value))
+        return cells
+
+    def display(self, lo: int, hi: int) -> list:
+        return self.labels[lo:hi]
+
+    def has_numbers(self, lo: int, hi: int) -> bool:
+        return False
+
+    def find(self, match) -> list[int]:
+        hits: dict = {}
+        found: list[int] = []
+        for i, label in enumerate(self.labels):
+            hit = hits.get(label)
+            if hit is None:
+                hit = hits[label] = bool(match(label))
+            if hit:
+                found.append(i)
+        return found
+
+    def numbers(self, rows: list[int]) -> list:
+        return [None] * len(rows)
+
+    def __eq__(self, other):
+        return (
+            type(other) is _DateColumn
+            and self.kinds == other.kinds
+            and self.values == other.values
+        )
+
+
+class _ObjectColumn:
+    __slots__ = ("codes", "values", "displayed", "numeric")
+
+    def __init__(self, cells: list, display):
+        self.codes = array("I", bytes(4 * len(cells)))
+        self.values: list = []
+        self.displayed: list = []
+
+        # Ключ с типом: иначе True, 1 и 1.0 слились бы в одно значение
+        codes: dict[tuple, int] = {}
+        for i, cell in enumerate(cells):
+            key = (type(cell), cell)
+            code = codes.get(key)
+            if code is None:
+                code = codes[key] = len(self.values)
+                self.values.append(cell)
+                self.displayed.append(display(cell))
+            self.codes[i] = code
+
+        # Коды значений-чисел (bool – тоже число, как и у isinstance)
+        self.numeric = frozenset(
+            code
+            for code, value in enumerate(self.values)
+            if isinstance(value, (int, float))
+        )
+
+    def slice(self, lo: int, hi: int) -> list:
+        values = self.values
+        return [values[code] for code in self.codes[lo:hi]]
+
+    def display(self, lo: int, hi: int) -> list:
+        displayed = self.displayed
+        return [displayed[code] for code in self.codes[lo:hi]]
+
+    def has_numbers(self, lo: int, hi: int) -> bool:
+        numeric = self.numeric
+        return bool(numeric) and any(code in numeric for code in self.codes[lo:hi])
+
+    def find(self, match) -> list[int]:
+        # match зовём по разу на различное значение, строки ищем по кодам
+        hits = {code for code, cell in enumerate(self.displayed) if match(cell)}
+        return [i for i, code in enumerate(self.codes) if code in hits]
+
+    def numbers(self, rows: list[int]) -> list:
+        values = self.values
+        cells = [values[self.codes[i]] for i in rows]
+        return [
+            (
+                cell
+                if isinstance(cell, (int, float)) and not isinstance(cell, bool)
+                else None
+            )
+            for cell in cells
+        ]
+
+    def __eq__(self, other):
+        return (
+            type(other) is _ObjectColumn
+            and self.codes == other.codes
+            and self.values == other.values
+            and list(map(type, self.values)) == list(map(type, other.values))
+        )
+
+
+def _make_column(cells: list, display):
+    if _NumberColumn.accepts(cells):
+        return _NumberColumn(cells)
+    if _DateColumn.accepts(cells):
+        return _DateColumn(cells, display)
+    return _ObjectColumn(cells, display)
+
+
+class RowTable:
+    """
+    Неизменяемая таблица строк листа в колоночном виде.
+
+    Снаружи выглядит как список кортежей: len(), table[i] – кортеж ячеек
+    исходной длины, table[lo:hi] – список кортежей, итерация по строкам.
+    Для ответа API строки собираются сразу в готовом виде (display_rows).
+
+    display(cell) – значение ячейки для фронта; вызывается при построении
+    один раз на каждое различное значение колонки (для дат – на каждый день).
+    """
+
+    __slots__ = ("size", "width", "lengths", "columns")
+
+    def __init__(self, rows: list[tuple], display):
+        width = max((len(row) for row in rows), default=0)
+        self._fill(
+            len(rows),
+            [[row[j] if j < len(row) else None for row in rows] for j in range(width)],
+            [len(row) for row in rows],
+            display,
+        )
+
+    @classmethod
+    def from_columns(
+        cls, size: int, columns: list[list], lengths: list[int] | None, display
+    ) -> "RowTable":
+        """
+        Таблица сразу из колонок (снапшот хранит строки так же), без сборки
+        кортежей строк. Ячейки за концом короткой строки в колонке – None,
+        lengths – длины строк (None – все строки шириной len(columns)).
+        """
+        table = cls.__new__(cls)
+        table._fill(size, columns, lengths, display)
+        return table
+
+    def _fill(
+        self, size: int, columns: list[list], lengths: list[int] | None, display
+    ) -> None:
+        self.size = size
+        self.width = len(columns)
+
+        # Длины строк храним, только если они разные
+        self.lengths = None
+        if lengths is not None and any(n != self.width for n in lengths):
+            self.lengths = array("I", lengths)
+
+        self.columns = [_make_column(cells, display) for cells in columns]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _rows(self, lo: int, hi: int, columns: list[list]) -> list:
+        if not columns:
+            return [()] * (hi - lo)
+        rows = list(zip(*columns))
+        if self.lengths is not None:
+            rows = [row[:n] for row, n in zip(rows, self.lengths[lo:hi])]
+        return rows
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            lo, hi, step = key.indices(len(self))
+            rows = self._rows(lo, hi, [c.slice(lo, hi) for c in self.columns])
+            return rows if step == 1 else rows[::step]
+
+        n = len(self)
+        i = key + n if key < 0 else key
+        if not 0 <= i < n:
+            raise IndexError("RowTable index out of range")
+        return self._rows(i, i + 1, [c.slice(i, i + 1) for c in self.columns])[0]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def display_rows(self, lo: int, hi: int, width: int) -> list[list]:
+        """
+        Строки lo..hi для фронта: не шире width, ячейки – display(ячейка),
+        полностью пустые строки пропускаются.
+        """
+        columns = [c.display(lo, hi) for c in self.columns[:width]]
+        rows: list[list] = []
+        for row in self._rows(lo, hi, columns):
+            if any(cell is not None for cell in row):
+                rows.append(list(row))
+        return rows
+
+    def project_rows(self, lo: int, hi: int, picked: list[int]) -> list[list]:
+        """
+        Строки lo..hi для фронта только из колонок picked (в их порядке).
+        Все строки одной длины, пустые не пропускаются – номер строки в
+        ответе совпадает с номером в таблице (нужно для постраничной выдачи).
+        """
+        empty = [None] * (hi - lo)
+        columns = [
+            self.columns[j].display(lo, hi) if j < self.width else empty for j in picked
+        ]
+        if not columns:
+            return [[] for _ in range(hi - lo)]
+        return [list(row) for row in zip(*columns)]
+
+    def numeric_columns(
+        self, lo: int, hi: int, width: int, picked: list[int] | None = None
+    ) -> list[int]:
+        """
+        Номера колонок (меньше width), где в строках lo..hi есть числа.
+        С picked – номера внутри picked.
+        """
+        if picked is None:
+            picked = list(range(min(width, self.width)))
+        return [
+            k
+            for k, j in enumerate(picked)
+            if j < min(width, self.width) and self.columns[j].has_numbers(lo, hi)
+        ]
+
+    def find_rows(self, j: int, match) -> list[int]:
+        """
+        Номера строк, где match(display(ячейка колонки j)) истинно.
+        """
+        if j >= self.width:
+            return []
+        return self.columns[j].find(match)
+
+    def numbers(self, j: int, rows: list[int]) -> list:
+        """
+        Числа колонки j в строках rows (не число или нет ячейки – None).
+        """
+        if j >= self.width:
+            return [None] * len(rows)
+        return self.columns[j].numbers(rows)
+
+    def __eq__(self, other):
+        if not isinstance(other, RowTable):
+            return NotImplemented
+        return (
+            self.size == other.size
+            and self.width == other.width
+            and self.lengths == other.lengths
+            and self.columns == other.columns
+        )
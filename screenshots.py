@@ -0,0 +1,205 @@
+# screenshots.py
+#
+# Скриншоты дашборда: приём PNG потоком прямо на диск, пережатие и чистка
+# старых файлов в фоне.
+#
+# Тело запроса читается кусками и сразу пишется во временный файл в папке
+# скриншотов, целиком в памяти картинка не держится. Пережатие (WebP или
+# оптимизированный PNG, нужен Pillow) и чистка по сроку/количеству идут в
+# одном фоновом потоке, ответ клиенту их не ждёт.
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import os
+import tempfile
+import threading
+import time
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не обязателен, без него храним PNG как есть
+    Image = None
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+CHUNK_SIZE = 256 * 1024
+FILE_PREFIX = "trastboard_"
+
+# Форматы, в которые умеем пережимать
+FORMATS = ("webp", "png")
+WEBP_QUALITY = 90
+
+
+class ScreenshotError(ValueError):
+    """
+    Скриншот не принят: не PNG, пустой или больше лимита.
+    """
+
+
+def save_stream(read, directory: Path, max_bytes: int) -> Path:
+    """
+    Сохранить PNG из потока в directory под именем trastboard_<время>.png.
+
+    read(n) – чтение тела запроса (например, request.stream.read); читаем
+    кусками по CHUNK_SIZE, пока не вернётся пустой кусок. Больше max_bytes
+    или не PNG – ScreenshotError, временный файл удаляется.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".tmp")
+    tmp_path = Path(tmp_name)
+
+    try:
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0 and not chunk.startswith(PNG_SIGNATURE[: len(chunk)]):
+                    raise ScreenshotError("Ожидалось изображение PNG")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ScreenshotError(
+                        f"Скриншот больше {max_bytes // (1024 * 1024)} МБ"
+                    )
+                f.write(chunk)
+
+        if size < len(PNG_SIGNATURE):
+            raise ScreenshotError("Пустое изображение")
+
+        return _publish(tmp_path, directory, ".png")
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def save_bytes(data: bytes, directory: Path, suffix: str) -> Path:
+    """
+    Сохранить готовый файл (например, отрисованный на сервере дашборд) под
+    тем же именем, что и присланные скриншоты: trastboard_<время><suffix>.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".tmp")
+    tmp_path = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return _publish(tmp_path, directory, suffix)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def _publish(tmp_path: Path, directory: Path, suffix: str) -> Path:
+    """
+    Переименовать временный файл в trastboard_<время><suffix>; если в ту же
+    секунду уже был скриншот – добавляем _2, _3, ...
+    """
+    stem = FILE_PREFIX + datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    n = 1
+    while True:
+        path = directory / (stem + (f"_{n}" if n > 1 else "") + suffix)
+        try:
+            # link не перезаписывает существующий файл, в отличие от rename
+            os.link(tmp_path, path)
+        except FileExistsError:
+            n += 1
+            continue
+        tmp_path.unlink()
+        return path
+
+
+def recompress(path: Path, fmt: str) -> Path:
+    """
+    Пережать PNG в fmt ("webp" – без потерь видимого качества, "png" –
+    оптимизированный PNG). Новый файл заменяет старый, только если он
+    меньше. Без Pillow ничего не делает. Возвращает путь итогового файла.
+    """
+    if Image is None or fmt not in FORMATS:
+        return path
+
+    target = path.with_suffix("." + fmt)
+    # Точка в начале: временный файл не попадёт под чистку (apply_retention)
+    tmp_path = path.with_name(f".{path.stem}.{fmt}.tmp")
+
+    try:
+        with Image.open(path) as img:
+            if fmt == "webp":
+                img.save(tmp_path, "WEBP", quality=WEBP_QUALITY, method=6)
+            else:
+                img.save(tmp_path, "PNG", optimize=True)
+
+        if tmp_path.stat().st_size >= path.stat().st_size:
+            tmp_path.unlink()
+            return path
+
+        os.replace(tmp_path, target)
+        if target != path:
+            path.unlink(missing_ok=True)
+        return target
+    except Exception:
+        # Битая картинка, нехватка памяти в Pillow и т.п. – оставляем как было
+        tmp_path.unlink(missing_ok=True)
+        return path
+
+
+def apply_retention(directory: Path, keep_files: int, keep_days: float) -> None:
+    """
+    Удалить скриншоты старше keep_days дней и всё, что сверх keep_files
+    самых свежих (0 – без ограничения). Файлы, которые уже удалил кто-то
+    другой (соседний воркер), пропускаем.
+    """
+    entries = []
+    for path in directory.glob(FILE_PREFIX + "*"):
+        try:
+            entries.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            continue
+    entries.sort(reverse=True)
+
+    cutoff = time.time() - keep_days * 86400 if keep_days else None
+    for i, (mtime, path) in enumerate(entries):
+        if (keep_files and i >= keep_files) or (cutoff is not None and mtime < cutoff):
+            path.unlink(missing_ok=True)
+
+
+class ScreenshotWorker:
+    """
+    Фоновый поток для пережатия и чистки: задачи идут по одной, в порядке
+    поступления.
+    """
+
+    def __init__(
+        self, directory: Path, fmt: str | None, keep_files: int, keep_days: float
+    ):
+        self.directory = directory
+        self.fmt = fmt
+        self.keep_files = keep_files
+        self.keep_days = keep_days
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+        # Поток пула в дочернем процессе (воркер gunicorn) не существует
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, path: Path):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="screenshots"
+                )
+            return self._executor.submit(self._process, path)
+
+    def _process(self, path: Path) -> Path:
+        # Пережимаем только присланные PNG, отрисованные на сервере файлы – нет
+        try:
+            if self.fmt and path.suffix == ".png":
+                path = recompress(path, self.fmt)
+        finally:
+            apply_retention(self.directory, self.keep_files, self.keep_days)
+        return path
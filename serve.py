@@ -0,0 +1,52 @@
+# serve.py
+#
+# Боевой запуск дашборда: gunicorn с несколькими воркерами.
+#
+# Книгу разбирает и отслеживает только мастер-процесс (preload_app): воркеры
+# форкаются уже с готовыми данными и делят их с мастером copy-on-write, а
+# после рестарта те же данные поднимаются из снапшота (snapshot.py).
+# Когда Excel-файл меняется, мастер перечитывает его один раз и плавно
+# перезапускает воркеры (SIGHUP): новые стартуют уже с новой версией, старые
+# дообслуживают начатые запросы.
+
+import os
+import signal
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # gunicorn есть только под Unix
+    BaseApplication = None
+
+
+def run_server(app, host: str, port: int, workers: int, threads: int, on_ready):
+    """
+    Запустить app в боевом режиме.
+
+    on_ready(reload_workers) вызывается в мастер-процессе, когда он готов
+    принимать запросы, но воркеры ещё не запущены; reload_workers() плавно
+    перезапускает воркеры.
+
+    Без gunicorn (Windows) – один процесс с потоками на werkzeug.
+    """
+    if BaseApplication is None:
+        on_ready(lambda: None)
+        app.run(host=host, port=port, threaded=True, debug=False)
+        return
+
+    class DashboardApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("preload_app", True)
+            self.cfg.set("when_ready", _when_ready)
+
+        def load(self):
+            return app
+
+    def _when_ready(arbiter):
+        master_pid = arbiter.pid
+        on_ready(lambda: os.kill(master_pid, signal.SIGHUP))
+
+    DashboardApplication().run()
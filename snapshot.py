@@ -0,0 +1,248 @@
+# snapshot.py
+#
+# Снапшот разобранной книги: компактный колоночный файл рядом с Excel,
+# чтобы после рестарта не разбирать xlsx через openpyxl заново.
+#
+# Формат файла:
+#   MAGIC (8 байт) | длина метаданных (uint64) | метаданные JSON (utf-8)
+#   | выравнивание до 8 | блоки таблиц
+#
+# Таблица (строка заголовка + строки данных) хранится по колонкам:
+#   сначала типы ячеек всех колонок (1 байт на ячейку), выравнивание до 8,
+#   затем значения всех колонок (8 байт на ячейку: int64 или float64).
+# Строки хранятся словарём в метаданных таблицы, в ячейке – номер строки.
+# Даты – порядковые номера дня, datetime/time – микросекунды.
+
+from array import array
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+import json
+import os
+import struct
+
+MAGIC = b"TRSNAP01"
+_HEAD = struct.Struct("<8sQ")
+
+# Типы ячеек
+_NONE, _INT, _FLOAT, _STR, _BOOL, _DATETIME, _DATE, _TIME, _ABSENT = range(9)
+
+_EPOCH = datetime(1, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Ячейка за концом короткой строки (строки бывают разной длины)
+_MISSING = object()
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _encode_column(cells: list, strings: dict[str, int]) -> tuple[bytes, bytes]:
+    tags = bytearray(len(cells))
+    ints = array("q", bytes(8 * len(cells)))
+    floats = memoryview(ints).cast("B").cast("d")
+
+    for i, cell in enumerate(cells):
+        if cell is _MISSING:
+            tags[i] = _ABSENT
+        elif cell is None:
+            tags[i] = _NONE
+        elif isinstance(cell, bool):
+            tags[i] = _BOOL
+            ints[i] = int(cell)
+        elif isinstance(cell, int):
+            tags[i] = _INT
+            ints[i] = cell
+        elif isinstance(cell, float):
+            tags[i] = _FLOAT
+            floats[i] = cell
+        elif isinstance(cell, str):
+            tags[i] = _STR
+            ints[i] = strings.setdefault(cell, len(strings))
+        elif isinstance(cell, datetime):
+            if cell.tzinfo is not None:
+                raise ValueError(f"Дата с часовым поясом не поддерживается: {cell!r}")
+            tags[i] = _DATETIME
+            ints[i] = (cell - _EPOCH) // _MICROSECOND
+        elif isinstance(cell, date):
+            tags[i] = _DATE
+            ints[i] = cell.toordinal()
+        elif isinstance(cell, time):
+            if cell.tzinfo is not None:
+                raise ValueError(f"Время с часовым поясом не поддерживается: {cell!r}")
+            tags[i] = _TIME
+            ints[i] = (datetime.combine(_EPOCH.date(), cell) - _EPOCH) // _MICROSECOND
+        else:
+            raise ValueError(f"Неподдерживаемый тип ячейки: {type(cell).__name__}")
+
+    floats.release()
+    return bytes(tags), ints.tobytes()
+
+
+def _decode_column(
+    tags: bytes, ints: list[int], floats: list[float], strings: list[str]
+) -> list:
+    column: list = []
+    append = column.append
+
+    for tag, i, f in zip(tags, ints, floats):
+        if tag == _NONE:
+            append(None)
+        elif tag == _FLOAT:
+            append(f)
+        elif tag == _STR:
+            append(strings[i])
+        elif tag == _INT:
+            append(i)
+        elif tag == _DATETIME:
+            append(_EPOCH + timedelta(microseconds=i))
+        elif tag == _DATE:
+            append(date.fromordinal(i))
+        elif tag == _BOOL:
+            append(bool(i))
+        elif tag == _TIME:
+            append((_EPOCH + timedelta(microseconds=i)).time())
+        else:
+            append(_MISSING)
+
+    return column
+
+
+def write_snapshot(
+    path: Path,
+    source_stamp: tuple[int, int],
+    meta: dict,
+    tables: dict[str, tuple[tuple, list[tuple]]],
+) -> None:
+    """
+    Записать снапшот атомарно (через временный файл и os.replace).
+
+    source_stamp – (mtime_ns, size) исходного файла, по нему снапшот
+                   потом проверяется на актуальность;
+    meta         – произвольные JSON-данные вызывающего кода;
+    tables       – имя таблицы -> (заголовок, строки).
+    """
+    tables_meta: list[dict] = []
+    blocks: list[bytes] = []
+    offset = 0
+
+    for name, (header, rows) in tables.items():
+        all_rows = [header, *rows]
+        n = len(all_rows)
+        width = max((len(row) for row in all_rows), default=0)
+        strings: dict[str, int] = {}
+
+        tag_parts: list[bytes] = []
+        value_parts: list[bytes] = []
+        for j in range(width):
+            cells = [row[j] if j < len(row) else _MISSING for row in all_rows]
+            tags, values = _encode_column(cells, strings)
+            tag_parts.append(tags)
+            value_parts.append(values)
+
+        tags_block = b"".join(tag_parts)
+        block = tags_block + bytes(_pad8(len(tags_block)) - len(tags_block))
+        block += b"".join(value_parts)
+
+        tables_meta.append(
+            {
+                "name": name,
+                "offset": offset,
+                "rows": n,
+                "width": width,
+                "ragged": any(len(row) != width for row in all_rows),
+                "strings": list(strings),
+            }
+        )
+        blocks.append(block)
+        offset += len(block)
+
+    meta_bytes = json.dumps(
+        {"source_stamp": list(source_stamp), "meta": meta, "tables": tables_meta},
+        ensure_ascii=False,
+    ).encode("utf-8")
+    head = _HEAD.pack(MAGIC, len(meta_bytes)) + meta_bytes
+    head += bytes(_pad8(len(head)) - len(head))
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(head)
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(
+    path: Path, source_stamp: tuple[int, int]
+) -> tuple[dict, dict[str, tuple[tuple, list[list], list[int] | None]]] | None:
+    """
+    Прочитать снапшот.
+
+    Возвращает (meta, tables) или None, если файла нет, он битый или снят с
+    другой версии исходника. Таблицы – в том виде, в каком они лежат в файле:
+    имя таблицы -> (заголовок, колонки строк данных, длины строк). Ячейки за
+    концом короткой строки в колонках – None, длины строк – None, если все
+    строки одной ширины (см. RowTable.from_columns).
+    """
+    try:
+        with open(path, "rb") as f:
+            magic, meta_len = _HEAD.unpack(f.read(_HEAD.size))
+            if magic != MAGIC:
+                return None
+
+            header = json.loads(f.read(meta_len))
+            if tuple(header["source_stamp"]) != tuple(source_stamp):
+                return None
+
+            f.seek(_pad8(_HEAD.size + meta_len))
+            data = f.read()
+
+        with memoryview(data) as buf:
+            tables = {t["name"]: _read_table(buf, t) for t in header["tables"]}
+        return header["meta"], tables
+    except (OSError, ValueError, KeyError, IndexError, struct.error):
+        return None
+
+
+def _read_table(buf: memoryview, t: dict) -> tuple[tuple, list[list], list[int] | None]:
+    n, width = t["rows"], t["width"]
+    tags_start = t["offset"]
+    values_start = tags_start + _pad8(n * width)
+    if values_start + n * width * 8 > len(buf):
+        raise ValueError("Снапшот обрезан")
+
+    columns: list[list] = []
+    for j in range(width):
+        tags_at = tags_start + j * n
+        values_at = values_start + j * n * 8
+        with buf[tags_at : tags_at + n] as tags, buf[
+            values_at : values_at + n * 8
+        ] as values, values.cast("q") as ints, values.cast("d") as floats:
+            columns.append(
+                _decode_column(
+                    bytes(tags), ints.tolist(), floats.tolist(), t["strings"]
+                )
+            )
+
+    # Первая строка таблицы – заголовок
+    header = tuple(column[0] for column in columns)
+    columns = [column[1:] for column in columns]
+    if not t["ragged"]:
+        return header, (columns if n > 1 else []), None
+
+    header = _strip_missing(header)
+    lengths = [0] * (n - 1)
+    for j, column in enumerate(columns):
+        for i, cell in enumerate(column):
+            if cell is _MISSING:
+                column[i] = None
+            else:
+                lengths[i] = j + 1
+    return header, columns[: max(lengths, default=0)], lengths
+
+
+def _strip_missing(row: tuple) -> tuple:
+    end = len(row)
+    while end and row[end - 1] is _MISSING:
+        end -= 1
+    return row[:end]
@@ -13,6 +13,28 @@ const ORDER_STORAGE_KEY = "dashboard_block_order_v1";
 let availableDates = [];
 let activeDate = null; // строка вида "2025-12-08"
 
+// Блоки уже загруженных дат архива: дата -> { version, blocks }.
+// Соседние даты подгружаем заранее одним запросом к /api/blocks/range.
+const blocksCache = new Map();
+const PREFETCH_NEIGHBOURS = 2; // сколько дат с каждой стороны от активной
+
+// Что сейчас на экране: версия книги и блоки (для дельт /api/blocks?since=)
+let blocksVersion = null;
+let currentBlocks = [];
+
+// Об обновлении книги сервер сообщает через /api/events (SSE).
+// Если канал недоступен – перепроверяем данные по таймеру.
+const AUTO_REFRESH_MS = 60 * 1000;
+let pollingTimer = null;
+// После стольких ошибок подряд считаем канал недоступным и включаем таймер
+// (браузер при этом продолжает переподключаться сам)
+const EVENTS_ERROR_LIMIT = 3;
+const VERSION_RETRY_LIMIT = 10;
+const VERSION_RETRY_MS = 1000;
+
+// Перетаскиваемая карточка
+let draggedCard = null;
+
 // Глобальный элемент для кастомного тултипа цен
 let priceTooltipEl = null;
 let priceTooltipAnchorEl = null; // ячейка, над/под которой показываем подсказку
@@ -20,6 +42,7 @@ let priceTooltipAnchorEl = null; // ячейка, над/под которой 
 document.addEventListener("DOMContentLoaded", () => {
   setupArchiveUI();
   fetchDatesAndInit();
+  subscribeToUpdates();
 
   const screenshotBtn = document.getElementById("screenshotButton");
   if (screenshotBtn) {
@@ -43,16 +66,21 @@ async function handleScreenshotClick() {
       windowHeight: document.documentElement.scrollHeight,
     });
 
-    // 1) Кодируем изображение в base64 (PNG)
-    const dataUrl = canvas.toDataURL("image/png");
+    // 1) Кодируем изображение в PNG один раз (Blob, без base64)
+    const blob = await new Promise((resolve) =>
+      canvas.toBlob(resolve, "image/png")
+    );
+    if (!blob) {
+      throw new Error("Не удалось получить изображение из canvas");
+    }
 
-    // 2) Отправляем на сервер для сохранения в папку screenshots
+    // 2) Отправляем на сервер как есть, сервер пишет его на диск потоком
     const res = await fetch("/api/screenshot", {
       method: "POST",
       headers: {
-        "Content-Type": "application/json",
+        "Content-Type": "image/png",
       },
-      body: JSON.stringify({ imageData: dataUrl }),
+      body: blob,
     });
 
     const resData = await res.json();
@@ -63,26 +91,22 @@ async function handleScreenshotClick() {
     console.log("Скрин сохранён на сервере как:", resData.fileName);
 
     // 3) Дополнительно — скачать скрин локально в браузер (можно убрать, если не нужно)
-    canvas.toBlob((blob) => {
-      if (!blob) return;
-
-      const link = document.createElement("a");
-
-      const now = new Date();
-      const pad = (n) => String(n).padStart(2, "0");
-      const fileName = `trastboard_${now.getFullYear()}-${pad(
-        now.getMonth() + 1
-      )}-${pad(now.getDate())}_${pad(now.getHours())}-${pad(
-        now.getMinutes()
-      )}-${pad(now.getSeconds())}.png`;
-
-      link.href = URL.createObjectURL(blob);
-      link.download = fileName;
-      document.body.appendChild(link);
-      link.click();
-      document.body.removeChild(link);
-      URL.revokeObjectURL(link.href);
-    });
+    const link = document.createElement("a");
+
+    const now = new Date();
+    const pad = (n) => String(n).padStart(2, "0");
+    const fileName = `trastboard_${now.getFullYear()}-${pad(
+      now.getMonth() + 1
+    )}-${pad(now.getDate())}_${pad(now.getHours())}-${pad(
+      now.getMinutes()
+    )}-${pad(now.getSeconds())}.png`;
+
+    link.href = URL.createObjectURL(blob);
+    link.download = fileName;
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+    URL.revokeObjectURL(link.href);
   } catch (err) {
     console.error("Ошибка при создании/сохранении скрина:", err);
     alert("Не удалось сделать скрин. Подробности в консоли разработчика.");
@@ -212,6 +236,13 @@ async function fetchBlocksForActiveDate() {
 /* ---------------------- ЗАГРУЗКА БЛОКОВ ---------------------- */
 
 async function fetchBlocks(dateStr) {
+  if (dateStr && blocksCache.has(dateStr)) {
+    const cached = blocksCache.get(dateStr);
+    showBlocks(cached.version, cached.blocks);
+    prefetchNeighbourDates(dateStr);
+    return;
+  }
+
   let url = "/api/blocks";
   if (dateStr) {
     url += "?date=" + encodeURIComponent(dateStr);
@@ -232,7 +263,12 @@ async function fetchBlocks(dateStr) {
       return;
     }
 
-    renderBlocks(data.blocks);
+    showBlocks(data.version || null, data.blocks);
+
+    if (dateStr) {
+      blocksCache.set(dateStr, { version: blocksVersion, blocks: data.blocks });
+      prefetchNeighbourDates(dateStr);
+    }
   } catch (err) {
     console.error(err);
     showError(
@@ -241,6 +277,312 @@ async function fetchBlocks(dateStr) {
   }
 }
 
+// Подгружаем соседние с dateStr даты архива, чтобы переключение было мгновенным
+async function prefetchNeighbourDates(dateStr) {
+  const idx = availableDates.indexOf(dateStr);
+  if (idx < 0) return;
+
+  const wanted = availableDates
+    .slice(Math.max(0, idx - PREFETCH_NEIGHBOURS), idx + PREFETCH_NEIGHBOURS + 1)
+    .filter((d) => !blocksCache.has(d));
+  if (!wanted.length) return;
+
+  try {
+    const res = await fetch(
+      "/api/blocks/range?dates=" + encodeURIComponent(wanted.join(","))
+    );
+    if (!res.ok) return;
+
+    const data = await res.json();
+    // Пока шёл запрос, книга могла обновиться (onWorkbookUpdated уже очистил
+    // кэш) – блоки старой версии в кэш не кладём
+    if (!data || data.version !== blocksVersion) return;
+
+    const byDate = data.blocksByDate || {};
+    Object.entries(byDate).forEach(([d, blocks]) => {
+      if (Array.isArray(blocks)) {
+        blocksCache.set(d, { version: data.version || null, blocks });
+      }
+    });
+  } catch (err) {
+    // Не критично: дата просто загрузится по клику
+    console.warn("Не удалось подгрузить соседние даты:", err);
+  }
+}
+
+function showBlocks(version, blocks) {
+  blocksVersion = version;
+  currentBlocks = blocks;
+  renderBlocks(blocks);
+}
+
+/* ---------------------- ОБНОВЛЕНИЕ ДЕЛЬТОЙ ---------------------- */
+
+function subscribeToUpdates() {
+  if (typeof EventSource === "undefined") {
+    startPolling();
+    return;
+  }
+
+  const source = new EventSource("/api/events");
+  let errorsInRow = 0;
+
+  source.addEventListener("open", () => {
+    errorsInRow = 0;
+    if (pollingTimer !== null) {
+      // Канал снова работает: таймер больше не нужен, а пропущенное
+      // за время без канала проверяем сразу
+      stopPolling();
+      pollForUpdates();
+    }
+  });
+
+  source.addEventListener("version", (event) => {
+    let data;
+    try {
+      data = JSON.parse(event.data);
+    } catch {
+      return;
+    }
+
+    // Пока блоки не загружены или версия та же – делать нечего
+    if (!data || !blocksVersion || data.version === blocksVersion) return;
+    onWorkbookUpdated(data.version);
+  });
+
+  source.addEventListener("error", () => {
+    // CLOSED – браузер сдался; отказ в соединении (канал не запущен, порт
+    // закрыт) он же повторяет бесконечно в CONNECTING – тоже переходим на
+    // таймер, если ошибки идут подряд
+    errorsInRow += 1;
+    if (
+      source.readyState === EventSource.CLOSED ||
+      errorsInRow >= EVENTS_ERROR_LIMIT
+    ) {
+      startPolling();
+    }
+  });
+}
+
+function startPolling() {
+  if (pollingTimer === null) {
+    pollingTimer = setInterval(pollForUpdates, AUTO_REFRESH_MS);
+  }
+}
+
+function stopPolling() {
+  if (pollingTimer !== null) {
+    clearInterval(pollingTimer);
+    pollingTimer = null;
+  }
+}
+
+// Проверка по таймеру: та же дельта, что и у refreshBlocks, но если версия
+// книги сменилась, обновляемся так же, как по событию (onWorkbookUpdated)
+async function pollForUpdates() {
+  if (!blocksVersion) return;
+
+  let url = "/api/blocks?since=" + encodeURIComponent(blocksVersion);
+  if (activeDate) {
+    url += "&date=" + encodeURIComponent(activeDate);
+  }
+
+  try {
+    const res = await fetch(url);
+    const data = await res.json();
+    if (!res.ok || !data.version || data.version === blocksVersion) return;
+
+    // Кэш соседних дат, список дат и сами блоки – всё как при событии
+    // (тело этой дельты сервер уже держит в кэше, повторный запрос дешёвый)
+    await onWorkbookUpdated(data.version);
+  } catch (err) {
+    console.warn("Не удалось проверить обновления:", err);
+  }
+}
+
+async function onWorkbookUpdated(version, attempt = 0) {
+  // Подгруженные заранее даты архива могли измениться вместе с книгой
+  blocksCache.clear();
+
+  const switched = await refreshDates();
+  if (switched) {
+    await fetchBlocksForActiveDate();
+  } else {
+    await refreshBlocks();
+  }
+
+  // Воркеры сервера перезапускаются плавно, и запрос мог попасть в старый –
+  // тогда пробуем ещё раз чуть позже
+  if (blocksVersion !== version && attempt < VERSION_RETRY_LIMIT) {
+    setTimeout(() => onWorkbookUpdated(version, attempt + 1), VERSION_RETRY_MS);
+  }
+}
+
+// Обновляем список дат архива. Если смотрели последнюю дату, а появилась
+// новая – переключаемся на неё. Возвращает true, если активная дата сменилась.
+async function refreshDates() {
+  try {
+    const res = await fetch("/api/dates");
+    const data = await res.json();
+    if (!res.ok || !Array.isArray(data.dates)) return false;
+
+    const wasLatest = !activeDate || activeDate === availableDates[0];
+    availableDates = data.dates;
+
+    let switched = false;
+    if (wasLatest && availableDates.length && availableDates[0] !== activeDate) {
+      activeDate = availableDates[0];
+      switched = true;
+    }
+
+    updateActiveDateLabel();
+    renderArchiveMenu();
+    return switched;
+  } catch (err) {
+    console.warn("Не удалось обновить список дат:", err);
+    return false;
+  }
+}
+
+// Перепроверяем активную дату: сервер отдаёт только изменения относительно
+// blocksVersion, перерисовываем только изменившиеся карточки
+async function refreshBlocks() {
+  if (!blocksVersion) return;
+
+  let url = "/api/blocks?since=" + encodeURIComponent(blocksVersion);
+  if (activeDate) {
+    url += "&date=" + encodeURIComponent(activeDate);
+  }
+
+  try {
+    const res = await fetch(url);
+    const data = await res.json();
+    if (!res.ok) return;
+
+    if (data.delta) {
+      if (data.version === blocksVersion) return;
+      applyBlocksDelta(data);
+    } else if (Array.isArray(data.blocks)) {
+      // сервер уже не помнит нашу версию – пришли блоки целиком
+      showBlocks(data.version || null, data.blocks);
+    }
+
+    if (activeDate) {
+      blocksCache.set(activeDate, {
+        version: blocksVersion,
+        blocks: currentBlocks,
+      });
+    }
+  } catch (err) {
+    console.warn("Не удалось обновить данные:", err);
+  }
+}
+
+// Те же ключи строк, что считает сервер (_row_keys в app.py)
+function rowKeysFor(rows, keyCol) {
+  const seen = new Map();
+  return rows.map((row) => {
+    const cell = keyCol < row.length ? row[keyCol] : null;
+    let text = "";
+    if (cell !== null && cell !== undefined) {
+      text = typeof cell === "string" ? cell.trim() : String(cell);
+    }
+    const n = seen.get(text) || 0;
+    seen.set(text, n + 1);
+    return JSON.stringify([text, n]);
+  });
+}
+
+function applyBlocksDelta(delta) {
+  const byName = new Map(currentBlocks.map((b) => [b.sheetName, b]));
+  const changed = new Set();
+
+  for (const change of delta.changes || []) {
+    changed.add(change.sheetName);
+
+    if (change.block) {
+      byName.set(change.sheetName, change.block);
+      continue;
+    }
+
+    const old = byName.get(change.sheetName);
+    if (!old) {
+      // рассинхрон с сервером – проще перезагрузить целиком
+      blocksVersion = null;
+      return fetchBlocksForActiveDate();
+    }
+
+    const oldRows = old.rows || [];
+    const oldKeys = rowKeysFor(oldRows, change.keyColumn);
+    const oldByKey = new Map(oldKeys.map((k, i) => [k, oldRows[i]]));
+    const upserts = new Map(
+      (change.upserts || []).map(([k, row]) => [JSON.stringify(k), row])
+    );
+
+    const rows = [];
+    for (const k of change.keys || []) {
+      const key = JSON.stringify(k);
+      const row = upserts.has(key) ? upserts.get(key) : oldByKey.get(key);
+      if (row === undefined) {
+        blocksVersion = null;
+        return fetchBlocksForActiveDate();
+      }
+      rows.push(row);
+    }
+
+    const patched = { ...old, ...(change.fields || {}), rows };
+    // Поля-словари (changes, prevValues) приходят правкой по ключам строк
+    for (const [field, patch] of Object.entries(change.fieldPatches || {})) {
+      const value = { ...(old[field] || {}), ...(patch.upserts || {}) };
+      for (const key of patch.deletes || []) {
+        delete value[key];
+      }
+      patched[field] = value;
+    }
+    byName.set(change.sheetName, patched);
+  }
+
+  const blocks = (delta.sheets || [])
+    .map((name) => byName.get(name))
+    .filter(Boolean);
+
+  blocksVersion = delta.version || null;
+  currentBlocks = blocks;
+  patchRenderedBlocks(blocks, changed);
+}
+
+// Заменяем только карточки изменившихся листов, остальные не трогаем
+function patchRenderedBlocks(blocks, changedSheetNames) {
+  const container = document.getElementById("blocksContainer");
+  if (!container) return;
+
+  const visibleBlocks = blocks.filter(
+    (b) => !HIDDEN_SHEET_NAMES.includes(b.sheetName)
+  );
+  const cards = new Map(
+    [...container.querySelectorAll(".block-card")].map((c) => [
+      c.dataset.blockId,
+      c,
+    ])
+  );
+
+  const sameCards =
+    visibleBlocks.length === cards.size &&
+    visibleBlocks.every((b) => cards.has(String(b.id)));
+  if (!sameCards) {
+    renderBlocks(blocks);
+    return;
+  }
+
+  visibleBlocks.forEach((block) => {
+    if (!changedSheetNames.has(block.sheetName)) return;
+
+    const newCard = createBlockCard(block);
+    container.replaceChild(newCard, cards.get(String(block.id)));
+    initCardDrag(newCard, container);
+  });
+}
+
 function showError(message) {
   const errorNode = document.getElementById("errorContainer");
   if (!errorNode) return;
@@ -392,8 +734,6 @@ function renderTableBlock(card, block, options = {}) {
     return;
   }
 
-  const isCompetitorsSheet = block.sheetName === COMPETITORS_SHEET_NAME;
-
   let visibleColIndices = cols.map((_, idx) => idx);
 
   if (hideDateColumn) {
@@ -439,13 +779,11 @@ function renderTableBlock(card, block, options = {}) {
     }
   });
 
-  // Для "Конкурентов" заранее определяем продуктовую колонку и карту вчерашних значений
-  const productOrigIdx =
-    isCompetitorsSheet && visibleColIndices.length > 0
-      ? visibleColIndices[0]
-      : null;
-  const prevDate = isCompetitorsSheet ? block.prevDate || null : null;
-  const prevValues = isCompetitorsSheet ? block.prevValues || {} : {};
+  // Изменения к предыдущей дате: сервер считает их для всех листов с датой,
+  // ключ строки – текст колонки block.keyColumn (как в rowKeysFor)
+  const prevDate = block.prevDate || null;
+  const changes = block.changes || {};
+  const keyColIdx = Number.isInteger(block.keyColumn) ? block.keyColumn : null;
 
   workRows.forEach((row) => {
     const tr = document.createElement("tr");
@@ -472,49 +810,38 @@ function renderTableBlock(card, block, options = {}) {
         td.classList.add("cell-number");
       }
 
-      // --- КАСТОМНЫЙ ТУЛТИП ДЛЯ БЛОКА "КОНКУРЕНТЫ" ---
+      // --- ТУЛТИП С ИЗМЕНЕНИЕМ К ПРЕДЫДУЩЕЙ ДАТЕ ---
       if (
-        isCompetitorsSheet &&
-        numericNew.includes(newIdx) &&
-        newIdx > 0 && // не на колонке "Продукт"
         prevDate &&
-        productOrigIdx !== null &&
-        typeof row[productOrigIdx] !== "undefined"
+        keyColIdx !== null &&
+        origIdx !== keyColIdx &&
+        numericNew.includes(newIdx)
       ) {
-        const productKey = String(row[productOrigIdx] ?? "").trim();
+        const keyCell = keyColIdx < row.length ? row[keyColIdx] : null;
+        let rowKey = "";
+        if (keyCell !== null && keyCell !== undefined) {
+          rowKey =
+            typeof keyCell === "string" ? keyCell.trim() : String(keyCell);
+        }
         const colName = cols[origIdx] || "";
-        const prevForProduct = prevValues[productKey];
-
-        if (
-          prevForProduct &&
-          Object.prototype.hasOwnProperty.call(prevForProduct, colName)
-        ) {
-          const prevRaw = prevForProduct[colName];
+        const cellChange = (changes[rowKey] || {})[colName];
 
+        if (cellChange) {
+          const [prevRaw, diff, pct] = cellChange;
           const prevFormatted = formatNumberWithSpaces(String(prevRaw));
 
-          const currNum = parseFloat(
-            String(rawVal).replace(/\s/g, "").replace(",", ".")
-          );
-          const prevNum = parseFloat(
-            String(prevRaw).replace(/\s/g, "").replace(",", ".")
-          );
-
-          let deltaStr = "";
+          let deltaStr = "0";
           let direction = "flat";
 
-          if (!Number.isNaN(currNum) && !Number.isNaN(prevNum)) {
-            const diff = currNum - prevNum;
-            if (Math.abs(diff) < 0.0001) {
-              deltaStr = "0";
-              direction = "flat";
-            } else {
-              const sign = diff > 0 ? "+" : "−";
-              const absDiff = Math.abs(diff);
-              const formattedAbs = formatNumberWithSpaces(String(absDiff));
-              deltaStr = `${sign}${formattedAbs}`;
-              direction = diff > 0 ? "up" : "down";
+          if (Math.abs(diff) >= 0.0001) {
+            const sign = diff > 0 ? "+" : "−";
+            const absDiff = formatNumberWithSpaces(String(Math.abs(diff)));
+            deltaStr = `${sign}${absDiff}`;
+            if (pct !== null && pct !== undefined) {
+              const absPct = String(Math.abs(pct)).replace(".", ",");
+              deltaStr += ` (${sign}${absPct}%)`;
             }
+            direction = diff > 0 ? "up" : "down";
           }
 
           const tooltipData = {
@@ -671,27 +998,8 @@ function findDateColumnIndex(block) {
 /* ---------------------- ПЕРЕТАСКИВАНИЕ БЛОКОВ ---------------------- */
 
 function initDragDrop(container) {
-  let draggedCard = null;
-
   container.querySelectorAll(".block-card").forEach((card) => {
-    card.addEventListener("dragstart", (event) => {
-      if (event.target.tagName === "TH") {
-        return;
-      }
-
-      draggedCard = card;
-      card.classList.add("dragging");
-      event.dataTransfer.effectAllowed = "move";
-      event.dataTransfer.setData("text/plain", card.dataset.blockId || "");
-    });
-
-    card.addEventListener("dragend", () => {
-      if (draggedCard) {
-        draggedCard.classList.remove("dragging");
-        draggedCard = null;
-      }
-      saveCurrentOrder(container);
-    });
+    initCardDrag(card, container);
   });
 
   container.addEventListener("dragover", (event) => {
@@ -708,6 +1016,27 @@ function initDragDrop(container) {
   });
 }
 
+function initCardDrag(card, container) {
+  card.addEventListener("dragstart", (event) => {
+    if (event.target.tagName === "TH") {
+      return;
+    }
+
+    draggedCard = card;
+    card.classList.add("dragging");
+    event.dataTransfer.effectAllowed = "move";
+    event.dataTransfer.setData("text/plain", card.dataset.blockId || "");
+  });
+
+  card.addEventListener("dragend", () => {
+    if (draggedCard) {
+      draggedCard.classList.remove("dragging");
+      draggedCard = null;
+    }
+    saveCurrentOrder(container);
+  });
+}
+
 function getDragAfterElement(container, mouseY) {
   const cards = [
     ...container.querySelectorAll(".block-card:not(.dragging)"),
@@ -893,7 +1222,7 @@ function showPriceTooltip(evt, data) {
   if (prevFormatted) {
     html += `
       <div class="price-tooltip__row">
-        <span class="price-tooltip__label">Вчера (${formatDateRu(
+        <span class="price-tooltip__label">Было (${formatDateRu(
           prevDate
         )}):</span>
         <span class="price-tooltip__value">${prevFormatted}</span>